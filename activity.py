@@ -0,0 +1,311 @@
+# backend/activity.py
+import os
+import logging
+import time
+import base64
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import and_, or_, func, delete, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from db import SessionLocal
+from models import History, UserFeatureStat
+
+logger = logging.getLogger(__name__)
+
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "10000"))
+HISTORY_FLUSH_MS = int(os.getenv("HISTORY_FLUSH_MS", "250"))
+HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", "500"))
+HISTORY_ENQUEUE_TIMEOUT = float(os.getenv("HISTORY_ENQUEUE_TIMEOUT", "0.5"))
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+# ============================================================
+# COUNTERS (bumped in the same transaction as the History insert)
+# ============================================================
+def bump_feature_stats(session: Session, increments: dict):
+    now = datetime.utcnow()
+    table = UserFeatureStat.__table__
+    upsert = _UPSERT_DIALECTS.get(session.get_bind().dialect.name)
+
+    for (user_id, feature), n in increments.items():
+        if upsert is not None:
+            stmt = upsert(table).values(user_id=user_id, feature=feature, count=n, updated_at=now)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.user_id, table.c.feature],
+                set_={"count": table.c.count + n, "updated_at": now},
+            )
+            session.execute(stmt)
+            continue
+
+        updated = session.execute(
+            table.update()
+            .where(table.c.user_id == user_id, table.c.feature == feature)
+            .values(count=table.c.count + n, updated_at=now)
+        ).rowcount
+        if not updated:
+            session.execute(table.insert().values(user_id=user_id, feature=feature, count=n, updated_at=now))
+
+
+# ============================================================
+# WRITE-BEHIND LOGGER
+# Routes enqueue events; a background task bulk-inserts them every
+# HISTORY_FLUSH_MS or HISTORY_FLUSH_ROWS, whichever comes first.
+# ============================================================
+_STOP = object()
+
+
+class HistoryWriter:
+    def __init__(self, session_factory, max_size: int, flush_ms: int, flush_rows: int, enqueue_timeout: float):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.flush_interval = flush_ms / 1000
+        self.flush_rows = flush_rows
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = None
+        self._task = None
+
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.direct_writes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        task, self._task = self._task, None
+        await self._queue.put(_STOP)
+        await task
+
+    async def enqueue(self, user_id: int, feature: str, details: str = None):
+        event = {
+            "user_id": user_id,
+            "feature": feature,
+            "details": details,
+            "created_at": datetime.utcnow(),
+        }
+        if self.running:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except asyncio.QueueFull:
+                pass
+            # Backpressure: wait for room, then fall back to writing this
+            # event ourselves so the producer slows down instead of losing it.
+            try:
+                await asyncio.wait_for(self._queue.put(event), self.enqueue_timeout)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+        self.direct_writes += 1
+        await asyncio.to_thread(self._write, [event])
+
+    # Several events from one request (e.g. /ai/pack) land in the same flush;
+    # the fallback writes them in one transaction.
+    async def enqueue_many(self, user_id: int, entries):
+        now = datetime.utcnow()
+        events = [
+            {"user_id": user_id, "feature": feature, "details": details, "created_at": now}
+            for feature, details in entries
+        ]
+        if not events:
+            return
+        if self.running and self._queue.maxsize - self._queue.qsize() >= len(events):
+            for event in events:
+                self._queue.put_nowait(event)
+            return
+
+        self.direct_writes += 1
+        await asyncio.to_thread(self._write, events)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.flush_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except Exception:
+            self.failed_rows += len(batch)
+            logger.exception("History flush failed")
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.flushed_rows += len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+    def _write(self, events):
+        with self.session_factory() as session:
+            session.execute(insert(History), events)
+            bump_feature_stats(session, Counter((e["user_id"], e["feature"]) for e in events))
+            session.commit()
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max": self.max_size,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_rows": self.failed_rows,
+            "direct_writes": self.direct_writes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+
+history_writer = HistoryWriter(
+    SessionLocal,
+    max_size=HISTORY_QUEUE_MAX,
+    flush_ms=HISTORY_FLUSH_MS,
+    flush_rows=HISTORY_FLUSH_ROWS,
+    enqueue_timeout=HISTORY_ENQUEUE_TIMEOUT,
+)
+
+
+# ============================================================
+# READ PATH (O(features) per user)
+# ============================================================
+def feature_counts(session: Session, user_id: int) -> dict:
+    rows = (
+        session.query(UserFeatureStat.feature, UserFeatureStat.count)
+        .filter(UserFeatureStat.user_id == user_id)
+        .all()
+    )
+    return dict(rows)
+
+
+# ============================================================
+# HISTORY LISTING (keyset on created_at DESC, id DESC)
+# ============================================================
+HISTORY_COLUMNS = (History.id, History.feature, History.details, History.created_at)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+def _history_query(session: Session, user_id: int, feature: str = None, since: datetime = None, until: datetime = None):
+    q = session.query(*HISTORY_COLUMNS).filter(History.user_id == user_id)
+    if feature:
+        q = q.filter(History.feature == feature)
+    if since:
+        q = q.filter(History.created_at >= since)
+    if until:
+        q = q.filter(History.created_at < until)
+    return q.order_by(History.created_at.desc(), History.id.desc())
+
+
+def history_page(session: Session, user_id: int, limit: int, cursor: str = None, **filters):
+    q = _history_query(session, user_id, **filters)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        q = q.filter(or_(
+            History.created_at < created_at,
+            and_(History.created_at == created_at, History.id < row_id),
+        ))
+
+    rows = q.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+# Server-side cursor + yield_per keeps exports in constant memory
+def iter_history(user_id: int, **filters):
+    with SessionLocal() as session:
+        q = _history_query(session, user_id, **filters)
+        q = q.execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+        for row in q:
+            yield row
+
+
+# ============================================================
+# REBUILD (recompute every counter from history in bulk)
+# ============================================================
+def rebuild_feature_stats(session: Session) -> int:
+    table = UserFeatureStat.__table__
+    session.execute(delete(table))
+    aggregated = select(
+        History.user_id,
+        History.feature,
+        func.count(),
+        func.max(History.created_at),
+    ).group_by(History.user_id, History.feature)
+    session.execute(
+        table.insert().from_select(["user_id", "feature", "count", "updated_at"], aggregated)
+    )
+    session.commit()
+    return session.query(func.count()).select_from(table).scalar()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import create_db
+
+    parser = argparse.ArgumentParser(description="StudyAI activity maintenance")
+    parser.add_argument("command", choices=["rebuild-stats"])
+    args = parser.parse_args()
+
+    create_db()
+    with SessionLocal() as session:
+        rows = rebuild_feature_stats(session)
+    print(f"Rebuilt {rows} user_feature_stats rows")
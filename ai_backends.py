@@ -0,0 +1,324 @@
+# backend/ai_backends.py
+import os
+import json
+import threading
+from typing import NamedTuple, Optional
+
+# ============================================================
+# FIX 1: REMOVE PROXY VARIABLES BEFORE ANY IMPORTS
+# ============================================================
+for key in ["HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY", "http_proxy", "https_proxy", "all_proxy"]:
+    if key in os.environ:
+        del os.environ[key]
+
+# ============================================================
+# FIX 2: IMPORT httpx BEFORE GROQ
+# Both are imported on first client build (see warmup), not at
+# startup: together they are ~300 ms of a cold start.
+# ============================================================
+
+from ai_resilience import AIUpstreamError
+
+# AI_BACKEND=groq (default) uses the Groq SDK; AI_BACKEND=openai talks to any
+# OpenAI-compatible /chat/completions endpoint at AI_BASE_URL, e.g. the
+# bundled fake_llm_server.py for offline load tests.
+AI_BACKEND = os.getenv("AI_BACKEND", "groq")
+AI_BASE_URL = os.getenv("AI_BASE_URL", "http://127.0.0.1:8001/v1")
+AI_API_KEY = os.getenv("AI_API_KEY", "")
+
+# ============================================================
+# ASYNC POOLED CLIENT (keeps hundreds of completions in flight
+# on one worker without tying up threadpool threads)
+# ============================================================
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "200"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "50"))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "30"))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))
+
+
+# ============================================================
+# FIX 3: NO-PROXY HTTP CLIENTS
+# ============================================================
+def _sync_http_client(**kwargs):
+    import httpx
+
+    return httpx.Client(
+        proxies=None,          # disable proxy usage
+        trust_env=False,       # prevents reading proxy env vars
+        follow_redirects=True,
+        timeout=httpx.Timeout(GROQ_TIMEOUT, connect=10.0),
+        **kwargs,
+    )
+
+
+def _async_http_client(**kwargs):
+    import httpx
+
+    return httpx.AsyncClient(
+        proxies=None,
+        trust_env=False,
+        follow_redirects=True,
+        timeout=httpx.Timeout(GROQ_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONNECTIONS,
+            max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+            keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+        ),
+        **kwargs,
+    )
+
+
+# Clients may be built by the startup warmup thread and a request at once
+_build_lock = threading.Lock()
+
+
+def _messages(prompt: str):
+    return [{"role": "user", "content": prompt}]
+
+
+# usage is (prompt_tokens, completion_tokens) when the provider reports it
+class Completion(NamedTuple):
+    text: str
+    usage: Optional[tuple] = None
+
+
+def _usage(usage):
+    if not usage:
+        return None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return usage.prompt_tokens, usage.completion_tokens
+
+
+# ============================================================
+# BACKEND INTERFACE
+# One attempt per call: retries, breaker and hedging live in
+# ai_resilience. Streams are opened by astream() and then iterated;
+# aclose() on the returned stream releases the connection, and its
+# `usage` is set once the provider sends it (usually the last chunk).
+# ============================================================
+class LLMBackend:
+    name = "base"
+
+    def complete(self, prompt: str, model: str, max_tokens: int, temperature: float) -> Completion:
+        raise NotImplementedError
+
+    async def acomplete(self, prompt: str, model: str, max_tokens: int, temperature: float) -> Completion:
+        raise NotImplementedError
+
+    async def astream(self, prompt: str, model: str, max_tokens: int, temperature: float):
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+    # Build clients (and import their SDKs) ahead of the first request
+    def warmup(self):
+        pass
+
+
+# ============================================================
+# GROQ (SDK); clients are built on first use so a missing key only
+# fails the AI routes, not the import
+# ============================================================
+class _GroqStream:
+    def __init__(self, stream):
+        self._stream = stream
+        self.usage = None
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            if chunk.x_groq is not None:
+                self.usage = _usage(chunk.x_groq.usage)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+    async def aclose(self):
+        await self._stream.response.aclose()
+
+
+class GroqBackend(LLMBackend):
+    name = "groq"
+
+    def __init__(self, api_key: str = None):
+        self.api_key = api_key
+        self._client = None
+        self._async_client = None
+
+    def _require_key(self):
+        if not self.api_key:
+            raise AIUpstreamError("GROQ_API_KEY is not configured")
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._require_key()
+            with _build_lock:
+                if self._client is None:
+                    http_client = _sync_http_client()
+                    from groq import Groq
+                    # FIX 4: Force Groq to use the clean HTTP client
+                    # Retries are owned by ai_resilience, not the SDK
+                    self._client = Groq(api_key=self.api_key, http_client=http_client, max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._require_key()
+            with _build_lock:
+                if self._async_client is None:
+                    http_client = _async_http_client()
+                    from groq import AsyncGroq
+                    self._async_client = AsyncGroq(api_key=self.api_key, http_client=http_client, max_retries=0)
+        return self._async_client
+
+    def warmup(self):
+        if self.api_key:
+            self.async_client
+
+    def complete(self, prompt, model, max_tokens, temperature):
+        response = self.client.chat.completions.create(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            messages=_messages(prompt),
+        )
+        return Completion(response.choices[0].message.content.strip(), _usage(response.usage))
+
+    async def acomplete(self, prompt, model, max_tokens, temperature):
+        response = await self.async_client.chat.completions.create(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            messages=_messages(prompt),
+        )
+        return Completion(response.choices[0].message.content.strip(), _usage(response.usage))
+
+    async def astream(self, prompt, model, max_tokens, temperature):
+        stream = await self.async_client.chat.completions.create(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            messages=_messages(prompt),
+            stream=True,
+        )
+        return _GroqStream(stream)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+        if self._client is not None:
+            self._client.close()
+
+
+# ============================================================
+# OPENAI-COMPATIBLE (plain httpx; errors surface as httpx.HTTPStatusError)
+# ============================================================
+class _SSEStream:
+    def __init__(self, response):
+        self._response = response
+        self.usage = None
+
+    async def __aiter__(self):
+        async for line in self._response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            chunk = json.loads(data)
+            usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+            if usage:
+                self.usage = _usage(usage)
+            choices = chunk.get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                yield delta
+
+    async def aclose(self):
+        await self._response.aclose()
+
+
+class OpenAICompatBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self, base_url: str, api_key: str = ""):
+        self.base_url = base_url.rstrip("/")
+        self._headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            with _build_lock:
+                if self._client is None:
+                    self._client = _sync_http_client(headers=self._headers)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            with _build_lock:
+                if self._async_client is None:
+                    self._async_client = _async_http_client(headers=self._headers)
+        return self._async_client
+
+    def warmup(self):
+        self.async_client
+
+    def _body(self, prompt, model, max_tokens, temperature, stream=False):
+        return {
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "messages": _messages(prompt),
+            "stream": stream,
+        }
+
+    def complete(self, prompt, model, max_tokens, temperature):
+        r = self.client.post(f"{self.base_url}/chat/completions", json=self._body(prompt, model, max_tokens, temperature))
+        r.raise_for_status()
+        body = r.json()
+        return Completion(body["choices"][0]["message"]["content"].strip(), _usage(body.get("usage")))
+
+    async def acomplete(self, prompt, model, max_tokens, temperature):
+        r = await self.async_client.post(
+            f"{self.base_url}/chat/completions", json=self._body(prompt, model, max_tokens, temperature)
+        )
+        r.raise_for_status()
+        body = r.json()
+        return Completion(body["choices"][0]["message"]["content"].strip(), _usage(body.get("usage")))
+
+    async def astream(self, prompt, model, max_tokens, temperature):
+        request = self.async_client.build_request(
+            "POST", f"{self.base_url}/chat/completions",
+            json=self._body(prompt, model, max_tokens, temperature, stream=True),
+        )
+        response = await self.async_client.send(request, stream=True)
+        if response.is_error:
+            await response.aread()
+            await response.aclose()
+            response.raise_for_status()
+        return _SSEStream(response)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+        if self._client is not None:
+            self._client.close()
+
+
+BACKENDS = {
+    "groq": lambda: GroqBackend(os.getenv("GROQ_API_KEY")),
+    "openai": lambda: OpenAICompatBackend(AI_BASE_URL, AI_API_KEY),
+}
+
+
+def make_backend(name: str = AI_BACKEND) -> LLMBackend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown AI_BACKEND {name!r}; expected one of {sorted(BACKENDS)}")
@@ -0,0 +1,303 @@
+# backend/ai_cache.py
+import os
+import logging
+import json
+import time
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import Future
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+from db import SessionLocal
+from models import AICacheEntry
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# CONFIG
+# ============================================================
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1") == "1"
+AI_CACHE_PERSIST = os.getenv("AI_CACHE_PERSIST", "1") == "1"
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", "86400"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "2048"))
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PDF_CACHE_MAX_ENTRIES = int(os.getenv("PDF_CACHE_MAX_ENTRIES", "256"))
+PDF_TEXT_CACHE_MAX_BYTES = int(os.getenv("PDF_TEXT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+PDF_MINDMAP_CACHE_MAX_BYTES = int(os.getenv("PDF_MINDMAP_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+PDF_RENDER_CACHE_MAX_BYTES = int(os.getenv("PDF_RENDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def make_key(feature: str, model: str, prompt: str, params: dict = None) -> str:
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    raw = json.dumps([feature, model, prompt_hash, params or {}], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(value) -> bool:
+    if isinstance(value, bytes):
+        return bool(value)
+    return isinstance(value, str) and bool(value) and not value.startswith("[AI Error]")
+
+
+def _size(value) -> int:
+    return len(value) if isinstance(value, bytes) else len(value.encode("utf-8"))
+
+
+# ============================================================
+# IN-PROCESS LRU TIER (TTL + entry/byte bounded)
+# ============================================================
+class LRUCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()   # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, size, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, size: int = None, ttl_seconds: int = None):
+        size = size if size is not None else len(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (ttl_seconds or self.ttl_seconds)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (expires_at, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, old_size, _) = self._data.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+
+# ============================================================
+# RESPONSE CACHE (memory tier + optional DB tier + counters)
+# ============================================================
+class ResponseCache:
+    def __init__(self, lru: LRUCache, persist: bool = False, enabled: bool = True):
+        self.lru = lru
+        self.persist = persist
+        self.enabled = enabled
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.db_hits = defaultdict(int)
+
+    # ---------- DB tier ----------
+    def _db_get(self, key):
+        try:
+            with SessionLocal() as session:
+                row = session.get(AICacheEntry, key)
+                if row is None:
+                    return None
+                if row.expires_at and row.expires_at < datetime.utcnow():
+                    session.delete(row)
+                    session.commit()
+                    return None
+                return row.value
+        except Exception as e:
+            logger.warning("AI cache DB read failed: %s", e)
+            return None
+
+    def _db_set(self, feature, key, value):
+        try:
+            with SessionLocal() as session:
+                session.merge(AICacheEntry(
+                    key=key,
+                    feature=feature,
+                    value=value,
+                    created_at=datetime.utcnow(),
+                    expires_at=datetime.utcnow() + timedelta(seconds=self.lru.ttl_seconds),
+                ))
+                session.commit()
+        except Exception as e:
+            logger.warning("AI cache DB write failed: %s", e)
+
+    # ---------- sync API ----------
+    def get(self, feature, key):
+        if not self.enabled:
+            return None
+        value = self.lru.get(key)
+        if value is None and self.persist:
+            value = self._db_get(key)
+            if value is not None:
+                self.db_hits[feature] += 1
+                self.lru.set(key, value, _size(value))
+        if value is None:
+            self.misses[feature] += 1
+        else:
+            self.hits[feature] += 1
+        return value
+
+    def set(self, feature, key, value):
+        if not self.enabled or not is_cacheable(value):
+            return
+        self.lru.set(key, value, _size(value))
+        if self.persist:
+            self._db_set(feature, key, value)
+
+    # ---------- async API (DB tier runs off the event loop) ----------
+    async def aget(self, feature, key):
+        if not self.enabled:
+            return None
+        value = self.lru.get(key)
+        if value is None and self.persist:
+            value = await asyncio.to_thread(self._db_get, key)
+            if value is not None:
+                self.db_hits[feature] += 1
+                self.lru.set(key, value, _size(value))
+        if value is None:
+            self.misses[feature] += 1
+        else:
+            self.hits[feature] += 1
+        return value
+
+    async def aset(self, feature, key, value):
+        if not self.enabled or not is_cacheable(value):
+            return
+        self.lru.set(key, value, _size(value))
+        if self.persist:
+            await asyncio.to_thread(self._db_set, feature, key, value)
+
+    def stats(self):
+        features = sorted(set(self.hits) | set(self.misses))
+        return {
+            "enabled": self.enabled,
+            "persist": self.persist,
+            "entries": len(self.lru),
+            "bytes": self.lru.size_bytes,
+            "evictions": self.lru.evictions,
+            "features": {
+                f: {
+                    "hits": self.hits[f],
+                    "misses": self.misses[f],
+                    "db_hits": self.db_hits[f],
+                    "hit_rate": round(self.hits[f] / ((self.hits[f] + self.misses[f]) or 1), 4),
+                }
+                for f in features
+            },
+        }
+
+
+response_cache = ResponseCache(
+    LRUCache(AI_CACHE_MAX_ENTRIES, AI_CACHE_MAX_BYTES, AI_CACHE_TTL_SECONDS),
+    persist=AI_CACHE_PERSIST,
+    enabled=AI_CACHE_ENABLED,
+)
+
+# Content-addressed stores for uploaded PDFs, keyed by SHA-256 of the bytes.
+# Extracted text stays in memory only; mindmaps are small enough to persist.
+pdf_text_cache = ResponseCache(
+    LRUCache(PDF_CACHE_MAX_ENTRIES, PDF_TEXT_CACHE_MAX_BYTES, AI_CACHE_TTL_SECONDS),
+    persist=False,
+    enabled=AI_CACHE_ENABLED,
+)
+pdf_mindmap_cache = ResponseCache(
+    LRUCache(PDF_CACHE_MAX_ENTRIES, PDF_MINDMAP_CACHE_MAX_BYTES, AI_CACHE_TTL_SECONDS),
+    persist=AI_CACHE_PERSIST,
+    enabled=AI_CACHE_ENABLED,
+)
+
+# Rendered /notes/pdf documents, keyed by hash of (title, notes)
+pdf_render_cache = ResponseCache(
+    LRUCache(PDF_CACHE_MAX_ENTRIES, PDF_RENDER_CACHE_MAX_BYTES, AI_CACHE_TTL_SECONDS),
+    persist=False,
+    enabled=AI_CACHE_ENABLED,
+)
+
+
+# ============================================================
+# SINGLE-FLIGHT (identical concurrent calls share one upstream completion)
+# ============================================================
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}    # key -> concurrent.futures.Future (sync callers)
+        self._tasks = {}    # key -> asyncio.Task (async callers)
+        self.leaders = defaultdict(int)
+        self.collapsed = defaultdict(int)
+
+    def do(self, feature, key, fn):
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self._calls[key] = fut
+
+        if not leader:
+            self.collapsed[feature] += 1
+            return fut.result()
+
+        self.leaders[feature] += 1
+        try:
+            result = fn()
+            fut.set_result(result)
+            return result
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def ado(self, feature, key, coro_fn):
+        task = self._tasks.get(key)
+        if task is not None:
+            self.collapsed[feature] += 1
+        else:
+            self.leaders[feature] += 1
+            # The upstream call runs in its own task so a cancelled caller
+            # (client disconnect) does not cancel it for everyone else.
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved when every waiter went away
+
+    def stats(self):
+        features = sorted(set(self.leaders) | set(self.collapsed))
+        return {
+            "in_flight": len(self._calls) + len(self._tasks),
+            "features": {
+                f: {"upstream_calls": self.leaders[f], "collapsed": self.collapsed[f]}
+                for f in features
+            },
+        }
+
+
+single_flight = SingleFlight()
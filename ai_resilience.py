@@ -0,0 +1,336 @@
+# backend/ai_resilience.py
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+AI_RETRY_ATTEMPTS = int(os.getenv("AI_RETRY_ATTEMPTS", "3"))
+AI_RETRY_BASE_MS = int(os.getenv("AI_RETRY_BASE_MS", "250"))
+AI_RETRY_MAX_MS = int(os.getenv("AI_RETRY_MAX_MS", "8000"))
+AI_RETRY_AFTER_MAX = float(os.getenv("AI_RETRY_AFTER_MAX", "20"))   # longer waits fail fast instead
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", "30"))
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "0") == "1"
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "95"))
+AI_HEDGE_MIN_MS = int(os.getenv("AI_HEDGE_MIN_MS", "500"))
+AI_HEDGE_MIN_SAMPLES = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))
+AI_LATENCY_WINDOW = int(os.getenv("AI_LATENCY_WINDOW", "200"))
+
+
+# ============================================================
+# TYPED ERRORS (main.py maps these to HTTP responses)
+# ============================================================
+class AIError(Exception):
+    status_code = 502
+    retryable = False
+    trips_breaker = False   # only upstream-health failures count
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AIRateLimited(AIError):
+    status_code = 503
+    retryable = True
+
+
+class AIUnavailable(AIError):
+    status_code = 503
+    retryable = True
+    trips_breaker = True
+
+
+class AITimeout(AIError):
+    status_code = 504
+    retryable = True
+    trips_breaker = True
+
+
+class AIUpstreamError(AIError):
+    status_code = 502
+
+
+class AICircuitOpen(AIUnavailable):
+    retryable = False
+    trips_breaker = False
+
+
+def _retry_after(response):
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None   # HTTP-date form; fall back to our own backoff
+
+
+def _from_status(status: int, response) -> AIError:
+    if status == 429:
+        return AIRateLimited("AI provider rate limit reached", _retry_after(response))
+    if status >= 500:
+        return AIUnavailable(f"AI provider error ({status})", _retry_after(response))
+    return AIUpstreamError(f"AI provider rejected the request ({status})")
+
+
+def _types(module: str, *names):
+    # The SDKs are imported lazily by ai_backends; if a module was never
+    # imported, nothing raised can be an instance of its exceptions.
+    mod = sys.modules.get(module)
+    return tuple(getattr(mod, name) for name in names) if mod is not None else ()
+
+
+# Covers both backends: Groq SDK exceptions and raw httpx errors
+def classify(exc: Exception) -> AIError:
+    if isinstance(exc, AIError):
+        return exc
+    if isinstance(exc, _types("groq", "APITimeoutError") + _types("httpx", "TimeoutException") + (asyncio.TimeoutError,)):
+        return AITimeout("AI provider timed out")
+    if isinstance(exc, _types("groq", "APIStatusError")):
+        return _from_status(exc.status_code, exc.response)
+    if isinstance(exc, _types("httpx", "HTTPStatusError")):
+        return _from_status(exc.response.status_code, exc.response)
+    if isinstance(exc, _types("groq", "APIConnectionError") + _types("httpx", "TransportError")):
+        return AIUnavailable("AI provider unreachable")
+    return AIUpstreamError(f"AI provider error: {exc}")
+
+
+# ============================================================
+# CIRCUIT BREAKER
+# closed -> open after N consecutive upstream failures; after the reset
+# window one probe call is let through (half-open) to decide which way to go.
+# ============================================================
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    # -> True when this call is the half-open probe
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return False
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe:
+                self._probe = True
+                return True
+            self.rejected += 1
+        raise AICircuitOpen("AI provider temporarily unavailable", retry_after=max(1.0, remaining))
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probe = False
+
+    # A probe that ended without an outcome (cancelled by a client
+    # disconnect, a losing hedge or a timeout) lets the next call probe
+    def release_probe(self):
+        with self._lock:
+            self._probe = False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyWindow:
+    def __init__(self, size: int):
+        self._samples = deque(maxlen=size)
+
+    def add(self, ms: float):
+        self._samples.append(ms)
+
+    def percentile(self, p: float, min_samples: int = 1):
+        samples = sorted(self._samples)
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+# ============================================================
+# EXECUTION POLICY
+# `attempt` is a zero-argument callable making one upstream call.
+# ============================================================
+class ExecutionPolicy:
+    def __init__(self, breaker: CircuitBreaker, attempts: int, base_ms: int, max_ms: int,
+                 retry_after_max: float, hedge: bool, hedge_percentile: float, hedge_min_ms: int,
+                 hedge_min_samples: int, latency_window: int):
+        self.breaker = breaker
+        self.attempts = attempts
+        self.base = base_ms / 1000
+        self.max_delay = max_ms / 1000
+        self.retry_after_max = retry_after_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min = hedge_min_ms / 1000
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyWindow(latency_window)
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _backoff(self, attempt_no: int, retry_after):
+        # Full jitter, but never sooner than the upstream asked for
+        delay = random.uniform(0, min(self.max_delay, self.base * 2 ** attempt_no))
+        if retry_after is not None:
+            if retry_after > self.retry_after_max:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def _record(self, err: AIError):
+        if err.trips_breaker:
+            self.breaker.record_failure()
+        elif not isinstance(err, AICircuitOpen):
+            self.breaker.record_success()   # upstream answered, just not usefully
+
+    def _next_delay(self, n: int, err: AIError):
+        if not err.retryable or n == self.attempts - 1:
+            return None
+        return self._backoff(n, err.retry_after)
+
+    def call(self, attempt):
+        self.calls += 1
+        for n in range(self.attempts):
+            probe = self.breaker.allow()
+            started = time.perf_counter()
+            try:
+                result = attempt()
+            except Exception as e:
+                err = classify(e)
+                self._record(err)
+                delay = self._next_delay(n, err)
+                if delay is None:
+                    self.failures += 1
+                    raise err from e
+                self.retries += 1
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Interrupted before the upstream answered: no verdict
+                if probe:
+                    self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            self.latency.add((time.perf_counter() - started) * 1000)
+            return result
+
+    async def acall(self, attempt, hedge: bool = True):
+        self.calls += 1
+        for n in range(self.attempts):
+            probe = self.breaker.allow()
+            started = time.perf_counter()
+            try:
+                if hedge and self.hedge:
+                    result = await self._hedged(attempt)
+                else:
+                    result = await attempt()
+            except Exception as e:
+                err = classify(e)
+                self._record(err)
+                delay = self._next_delay(n, err)
+                if delay is None:
+                    self.failures += 1
+                    raise err from e
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled (disconnect, losing hedge, timeout): no verdict
+                if probe:
+                    self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            self.latency.add((time.perf_counter() - started) * 1000)
+            return result
+
+    # Fire a second identical request if the first is slower than the
+    # recent p95; whichever succeeds first wins and the other is cancelled.
+    async def _hedged(self, attempt):
+        p = self.latency.percentile(self.hedge_percentile, self.hedge_min_samples)
+        primary = asyncio.ensure_future(attempt())
+        if p is None:
+            return await primary
+
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(self.hedge_min, p / 1000))
+            if done:
+                return primary.result()
+
+            self.hedges += 1
+            backup = asyncio.ensure_future(attempt())
+            tasks.add(backup)
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "hedging": self.hedge,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p50_ms": round(p50, 1) if p50 is not None else None,
+            "p95_ms": round(p95, 1) if p95 is not None else None,
+            "breaker": self.breaker.stats(),
+        }
+
+
+upstream_policy = ExecutionPolicy(
+    CircuitBreaker(AI_BREAKER_FAILURES, AI_BREAKER_RESET_SECONDS),
+    attempts=AI_RETRY_ATTEMPTS,
+    base_ms=AI_RETRY_BASE_MS,
+    max_ms=AI_RETRY_MAX_MS,
+    retry_after_max=AI_RETRY_AFTER_MAX,
+    hedge=AI_HEDGE_ENABLED,
+    hedge_percentile=AI_HEDGE_PERCENTILE,
+    hedge_min_ms=AI_HEDGE_MIN_MS,
+    hedge_min_samples=AI_HEDGE_MIN_SAMPLES,
+    latency_window=AI_LATENCY_WINDOW,
+)
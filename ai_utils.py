@@ -1,76 +1,192 @@
 import os
+import re
 import json
-from io import BytesIO
+import time
+import asyncio
+
+import ai_cache
+import metrics
+import pdf_utils
+from ai_backends import make_backend
+from ai_cache import response_cache, single_flight
+from ai_resilience import upstream_policy, classify
+from ratelimit import RateLimited, upstream_limiter, user_limiter
+from topic_index import topic_index
 
 # ============================================================
-# FIX 1: REMOVE PROXY VARIABLES BEFORE ANY IMPORTS
+# LLM BACKEND (AI_BACKEND=groq|openai, see ai_backends.py)
 # ============================================================
-for key in ["HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY", "http_proxy", "https_proxy", "all_proxy"]:
-    if key in os.environ:
-        del os.environ[key]
+backend = make_backend()
 
-from dotenv import load_dotenv
+MODEL = os.getenv("AI_MODEL", "llama-3.1-8b-instant")
+TEMPERATURE = 0.2
 
-# ============================================================
-# FIX 2: IMPORT httpx BEFORE GROQ
-# ============================================================
-import httpx
 
 # ============================================================
-# FIX 3: CREATE A NO-PROXY HTTP CLIENT
+# UPSTREAM CALLS (retries, circuit breaker and hedging via upstream_policy;
+# failures raise ai_resilience.AIError subclasses). `label` is the metrics
+# feature label: the cache feature, or a name for uncached calls.
 # ============================================================
-no_proxy_client = httpx.Client(
-    proxies=None,          # disable proxy usage
-    trust_env=False,       # prevents reading proxy env vars
-    follow_redirects=True,
-)
+# Non-streaming calls have no first token, so they only record the total
+def _record_llm(label, started, usage):
+    metrics.llm_total_seconds.labels(label).observe_since(started)
+    metrics.record_llm_usage(label, usage)
 
-from groq import Groq
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import PyPDF2
 
-load_dotenv()
+# Tokens an upstream call billed, for the caller's budget (ratelimit.py);
+# estimated from the text when the provider didn't report usage
+def _billed(prompt: str, text: str, usage) -> int:
+    if usage and all(n is not None for n in usage):
+        return sum(usage)
+    return estimate_tokens(prompt) + estimate_tokens(text)
+
+
+def _complete(prompt: str, max_tokens: int = 3000, label: str = "other"):
+    started = time.perf_counter()
+    try:
+        completion = upstream_policy.call(lambda: backend.complete(prompt, MODEL, max_tokens, TEMPERATURE))
+    except Exception as e:
+        metrics.llm_errors.labels(label, type(e).__name__).inc()
+        raise
+    _record_llm(label, started, completion.usage)
+    return completion.text
+
+
+# Async calls hold a slot of the global upstream cap (ratelimit.py) for the
+# whole call, retries included; the sync API is not used by the routes.
+# What the call billed is recorded against the request's reservation.
+async def _acomplete(prompt: str, max_tokens: int = 3000, label: str = "other"):
+    await upstream_limiter.acquire(label)
+    started = time.perf_counter()
+    try:
+        completion = await upstream_policy.acall(lambda: backend.acomplete(prompt, MODEL, max_tokens, TEMPERATURE))
+    except Exception as e:
+        metrics.llm_errors.labels(label, type(e).__name__).inc()
+        raise
+    finally:
+        upstream_limiter.release(time.perf_counter() - started)
+    _record_llm(label, started, completion.usage)
+    await user_limiter.record(_billed(prompt, completion.text, completion.usage))
+    return completion.text
+
 
 # ============================================================
-# GROQ CLIENT (Render-SAFE)
+# CACHED CALL (topic-keyed features pass `feature`; others skip the cache)
 # ============================================================
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+def _cache_key(feature: str, prompt: str, max_tokens: int):
+    return ai_cache.make_key(feature, MODEL, prompt, {"max_tokens": max_tokens, "temperature": TEMPERATURE})
 
-if not GROQ_API_KEY:
-    raise ValueError("❌ Missing GROQ_API_KEY in .env")
 
-# FIX 4: Force Groq to use the clean HTTP client
-client = Groq(
-    api_key=GROQ_API_KEY,
-    http_client=no_proxy_client
-)
+def _flight_key(feature: str, topic: str, **params):
+    return (feature, " ".join(str(topic).lower().split()), tuple(sorted(params.items())))
 
-MODEL = "llama-3.1-8b-instant"
+
+def _call_groq(prompt: str, max_tokens: int = 3000, feature: str = None, flight_key=None, label: str = None):
+    if not feature:
+        return _complete(prompt, max_tokens, label or "other")
+
+    key = _cache_key(feature, prompt, max_tokens)
+    cached = response_cache.get(feature, key)
+    if cached is not None:
+        return cached
+
+    def run():
+        text = _complete(prompt, max_tokens, feature)
+        response_cache.set(feature, key, text)
+        return text
+
+    return single_flight.do(feature, flight_key or key, run)
+
+
+async def _acall_groq(prompt: str, max_tokens: int = 3000, feature: str = None, flight_key=None, label: str = None):
+    if not feature:
+        return await _acomplete(prompt, max_tokens, label or "other")
+
+    key = _cache_key(feature, prompt, max_tokens)
+    cached = await response_cache.aget(feature, key)
+    if cached is not None:
+        return cached
+
+    async def run():
+        text = await _acomplete(prompt, max_tokens, feature)
+        await response_cache.aset(feature, key, text)
+        return text
+
+    return await single_flight.ado(feature, flight_key or key, run)
 
 
 # ============================================================
-# SAFE CALL WRAPPER
+# TOKEN STREAMING (closing the generator closes the upstream response)
 # ============================================================
-def _call_groq(prompt: str, max_tokens: int = 3000):
+# Only opening the stream is retried; once deltas have been sent a failure
+# is surfaced to the client rather than replayed.
+async def _astream(prompt: str, max_tokens: int = 3000, label: str = "other"):
+    await upstream_limiter.acquire(label)
+    started = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            temperature=0.2,
-            max_tokens=max_tokens,
-            messages=[{"role": "user", "content": prompt}]
+        stream = await upstream_policy.acall(
+            lambda: backend.astream(prompt, MODEL, max_tokens, TEMPERATURE), hedge=False
         )
-        return response.choices[0].message.content.strip()
+    except BaseException as e:
+        upstream_limiter.release(time.perf_counter() - started)
+        if isinstance(e, Exception):
+            metrics.llm_errors.labels(label, type(e).__name__).inc()
+        raise
+
+    parts = []
+    try:
+        async for delta in stream:
+            if not parts:
+                metrics.llm_ttft_seconds.labels(label).observe_since(started)
+            parts.append(delta)
+            yield delta
     except Exception as e:
-        return f"[AI Error] {str(e)}"
+        err = classify(e)
+        metrics.llm_errors.labels(label, type(err).__name__).inc()
+        raise err from e
+    finally:
+        await stream.aclose()
+        upstream_limiter.release(time.perf_counter() - started)
+        # A stream cut short is still billed for what it generated
+        await user_limiter.record(_billed(prompt, "".join(parts), stream.usage))
+
+    metrics.llm_total_seconds.labels(label).observe_since(started)
+    metrics.record_llm_usage(label, stream.usage)
+
+
+async def _astream_groq(prompt: str, max_tokens: int = 3000, feature: str = None, label: str = None):
+    key = _cache_key(feature, prompt, max_tokens) if feature else None
+    if key:
+        cached = await response_cache.aget(feature, key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    async for delta in _astream(prompt, max_tokens, feature or label or "other"):
+        parts.append(delta)
+        yield delta
+
+    # Only a fully received completion is cached
+    if key:
+        await response_cache.aset(feature, key, "".join(parts).strip())
+
+
+async def aclose():
+    await backend.aclose()
+
+
+# Imports the LLM SDK and builds its client; run off the event loop at startup
+def warmup():
+    backend.warmup()
 
 
 # ============================================================
-# REST OF YOUR FUNCTIONS (UNCHANGED)
+# PROMPTS + PARSERS (shared by the sync and async APIs)
 # ============================================================
 
-def generate_notes(topic: str):
-    prompt = f"""
+def _notes_prompt(topic: str):
+    return f"""
 Generate detailed, high-quality study notes for **{topic}**.
 
 Follow EXACT format:
@@ -97,11 +213,10 @@ Follow EXACT format:
 
 ## 7. Exam Revision Notes
 """
-    return _call_groq(prompt)
 
 
-def generate_plan(topic: str):
-    prompt = f"""
+def _plan_prompt(topic: str):
+    return f"""
 Create a structured study plan for **{topic}**.
 
 Sections:
@@ -110,7 +225,180 @@ Sections:
 - Weekly revision
 - Exam strategy
 """
-    return _call_groq(prompt)
+
+
+def _quiz_prompt(topic: str):
+    return f"""
+Generate 10 MCQs for **{topic}**
+Return JSON ONLY.
+"""
+
+
+def _flashcards_prompt(topic, count):
+    return f"Generate {count} flashcards for {topic}. JSON only."
+
+
+def _mindmap_prompt(title, text):
+    return f"""
+Create a hierarchical mindmap for **{title}** from the material below.
+Return JSON only, shaped as:
+{{"title": "...", "children": [{{"title": "...", "children": [...]}}]}}
+
+Material:
+{text}
+"""
+
+
+def _chunk_summary_prompt(title, chunk):
+    return f"""
+Summarize this part of **{title}** as a nested bullet outline of its key
+topics, subtopics and facts. Keep headings from the text. Outline only.
+
+Text:
+{chunk}
+"""
+
+
+_SPEAKERS = {"user": "User", "tutor": "Tutor"}
+
+
+def _transcript(turns):
+    return "\n".join(f"{_SPEAKERS.get(role, role)}: {text}" for role, text in turns)
+
+
+# summary/turns come from tutor.py, already trimmed to the prompt budget
+def _tutor_prompt(message: str, summary: str = "", turns=()):
+    if not summary and not turns:
+        return f"You are an AI tutor. Explain simply.\nUser: {message}"
+    parts = ["You are an AI tutor. Explain simply, continuing the conversation below."]
+    if summary:
+        parts.append(f"Summary of the earlier conversation:\n{summary}")
+    if turns:
+        parts.append(f"Recent conversation:\n{_transcript(turns)}")
+    parts.append(f"User: {message}")
+    return "\n\n".join(parts)
+
+
+def _tutor_summary_prompt(summary, turns, words):
+    return f"""
+Update the running summary of a tutoring conversation with the new turns.
+Keep what the student is studying, what was explained, their mistakes and
+open questions. Plain bullet points, under {words} words.
+
+Current summary:
+{summary or "(none)"}
+
+New turns:
+{_transcript(turns)}
+"""
+
+
+# ============================================================
+# INCREMENTAL JSON ARRAY PARSER
+# Emits each top-level object of a JSON array as soon as it closes,
+# so a malformed item is skipped without losing the rest.
+# ============================================================
+class JSONArrayItemParser:
+    def __init__(self):
+        self._buf = []
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.skipped = 0
+
+    def feed(self, chunk: str):
+        items = []
+        for c in chunk:
+            if not self._in_array:
+                if c == "[":
+                    self._in_array = True
+                continue
+
+            if self._depth == 0:
+                if c == "{":
+                    self._buf = [c]
+                    self._depth = 1
+                elif c == "]":
+                    self._in_array = False
+                continue
+
+            self._buf.append(c)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(json.loads("".join(self._buf)))
+                    except ValueError:
+                        self.skipped += 1
+                    self._buf = []
+        return items
+
+
+QUIZ_FALLBACK = {"q": "Error generating quiz", "options": ["", "", "", ""], "answer": 0}
+
+
+def _normalize_quiz_item(q):
+    try:
+        opts = q["options"]
+        return {
+            "q": q["q"],
+            "options": [opts["A"], opts["B"], opts["C"], opts["D"]],
+            "answer": "ABCD".index(q["answer"])
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _flashcard_fallback(topic):
+    return {"q": f"What is {topic}?", "a": "Definition"}
+
+
+def _parse_quiz(text):
+    quiz = [q for q in map(_normalize_quiz_item, JSONArrayItemParser().feed(text)) if q]
+    return quiz or [QUIZ_FALLBACK]
+
+
+def _parse_flashcards(text, topic):
+    cards = JSONArrayItemParser().feed(text)
+    return cards or [_flashcard_fallback(topic)]
+
+
+def _parse_mindmap(resp, title):
+    try:
+        return json.loads(resp[resp.index("{"): resp.rindex("}") + 1])
+    except:
+        return {"title": title, "children": []}
+
+
+# ============================================================
+# SYNC API
+# Topic features first resolve the topic against ones already generated
+# (topic_index.py), so case/punctuation variants and typos share a cache
+# entry and a single-flight slot.
+# ============================================================
+
+def generate_notes(topic: str):
+    topic = topic_index.resolve(topic)
+    key = _flight_key("notes", topic)
+    return _call_groq(_notes_prompt(topic), feature="notes", flight_key=key)
+
+
+def generate_plan(topic: str):
+    topic = topic_index.resolve(topic)
+    key = _flight_key("plan", topic)
+    return _call_groq(_plan_prompt(topic), feature="plan", flight_key=key)
 
 
 def answer_question(question: str):
@@ -125,97 +413,288 @@ Required:
 3. Example
 4. One-line summary
 """
-    return _call_groq(prompt)
+    return _call_groq(prompt, label="answer")
 
 
 def generate_quiz(topic: str):
-    prompt = f"""
-Generate 10 MCQs for **{topic}**
-Return JSON ONLY.
-"""
-    text = _call_groq(prompt)
+    topic = topic_index.resolve(topic)
+    key = _flight_key("quiz", topic)
+    return _parse_quiz(_call_groq(_quiz_prompt(topic), feature="quiz", flight_key=key))
 
-    try:
-        text = text[text.index("["): text.rindex("]") + 1]
-        raw = json.loads(text)
-    except:
-        return [{"q": "Error generating quiz", "options": ["", "", "", ""], "answer": 0}]
 
-    quiz = []
-    for q in raw:
-        opts = q["options"]
-        quiz.append({
-            "q": q["q"],
-            "options": [opts["A"], opts["B"], opts["C"], opts["D"]],
-            "answer": "ABCD".index(q["answer"])
-        })
-    return quiz
+def generate_flashcards(topic, count=8):
+    topic = topic_index.resolve(topic)
+    key = _flight_key("flashcards", topic, count=count)
+    text = _call_groq(_flashcards_prompt(topic, count), feature="flashcards", flight_key=key)
+    return _parse_flashcards(text, topic)
 
 
-def generate_flashcards(topic, count=8):
-    prompt = f"Generate {count} flashcards for {topic}. JSON only."
-    text = _call_groq(prompt)
+def generate_mindmap_from_text(title, text):
+    text = text[: MINDMAP_CONTEXT_TOKENS * CHARS_PER_TOKEN]
+    return _parse_mindmap(_call_groq(_mindmap_prompt(title, text), label="mindmap"), title)
 
-    try:
-        text = text[text.index("["): text.rindex("]") + 1]
-        return json.loads(text)
-    except:
-        return [{"q": f"What is {topic}?", "a": "Definition"}]
 
+def chat_with_tutor(message: str):
+    return _call_groq(_tutor_prompt(message), label="tutor")
 
-def generate_mindmap_from_text(title, text):
-    prompt = f"""
-Create a hierarchical mindmap.
-Return JSON only.
-"""
-    resp = _call_groq(prompt)
 
-    try:
-        return json.loads(resp[resp.index("{"): resp.rindex("}") + 1])
-    except:
+# ============================================================
+# ASYNC API (used by the FastAPI routes)
+# ============================================================
+
+async def generate_notes_async(topic: str):
+    topic = await topic_index.resolve_async(topic)
+    key = _flight_key("notes", topic)
+    return await _acall_groq(_notes_prompt(topic), feature="notes", flight_key=key)
+
+
+async def generate_plan_async(topic: str):
+    topic = await topic_index.resolve_async(topic)
+    key = _flight_key("plan", topic)
+    return await _acall_groq(_plan_prompt(topic), feature="plan", flight_key=key)
+
+
+async def generate_quiz_async(topic: str):
+    topic = await topic_index.resolve_async(topic)
+    key = _flight_key("quiz", topic)
+    return _parse_quiz(await _acall_groq(_quiz_prompt(topic), feature="quiz", flight_key=key))
+
+
+async def generate_flashcards_async(topic, count=8):
+    topic = await topic_index.resolve_async(topic)
+    key = _flight_key("flashcards", topic, count=count)
+    text = await _acall_groq(_flashcards_prompt(topic, count), feature="flashcards", flight_key=key)
+    return _parse_flashcards(text, topic)
+
+
+async def generate_mindmap_from_text_async(title, text):
+    if estimate_tokens(text) <= MINDMAP_CONTEXT_TOKENS:
+        return _parse_mindmap(await _acall_groq(_mindmap_prompt(title, text), feature="mindmap"), title)
+    return await generate_mindmap_from_pages_async(title, [text])
+
+
+async def chat_with_tutor_async(message: str, summary: str = "", turns=()):
+    return await _acall_groq(_tutor_prompt(message, summary, turns), label="tutor")
+
+
+async def summarize_tutor_async(summary: str, turns, max_tokens: int):
+    prompt = _tutor_summary_prompt(summary, turns, words=max_tokens * 3 // 4)
+    return (await _acomplete(prompt, max_tokens, "tutor_summary")).strip()
+
+
+async def stream_notes(topic: str):
+    topic = await topic_index.resolve_async(topic)
+    async for delta in _astream_groq(_notes_prompt(topic), feature="notes"):
+        yield delta
+
+
+async def stream_plan(topic: str):
+    topic = await topic_index.resolve_async(topic)
+    async for delta in _astream_groq(_plan_prompt(topic), feature="plan"):
+        yield delta
+
+
+def stream_tutor(message: str, summary: str = "", turns=()):
+    return _astream_groq(_tutor_prompt(message, summary, turns), label="tutor")
+
+
+async def stream_quiz(topic: str):
+    topic = await topic_index.resolve_async(topic)
+    parser = JSONArrayItemParser()
+    sent = 0
+    async for delta in _astream_groq(_quiz_prompt(topic), feature="quiz"):
+        for item in map(_normalize_quiz_item, parser.feed(delta)):
+            if item:
+                sent += 1
+                yield item
+    if not sent:
+        yield QUIZ_FALLBACK
+
+
+async def stream_flashcards(topic, count=8):
+    topic = await topic_index.resolve_async(topic)
+    parser = JSONArrayItemParser()
+    sent = 0
+    async for delta in _astream_groq(_flashcards_prompt(topic, count), feature="flashcards"):
+        for card in parser.feed(delta):
+            sent += 1
+            yield card
+    if not sent:
+        yield _flashcard_fallback(topic)
+
+
+# ============================================================
+# MAP-REDUCE MINDMAP FOR LARGE DOCUMENTS
+# pages -> token-budgeted chunks -> concurrent chunk summaries (cached by
+# content) -> merged summaries -> one hierarchical mindmap
+# ============================================================
+CHARS_PER_TOKEN = 4
+MINDMAP_CONTEXT_TOKENS = int(os.getenv("MINDMAP_CONTEXT_TOKENS", "6000"))
+MINDMAP_CHUNK_TOKENS = int(os.getenv("MINDMAP_CHUNK_TOKENS", "3000"))
+MINDMAP_SUMMARY_TOKENS = int(os.getenv("MINDMAP_SUMMARY_TOKENS", "600"))
+MINDMAP_CONCURRENCY = int(os.getenv("MINDMAP_CONCURRENCY", "4"))
+MINDMAP_REDUCE_ROUNDS = int(os.getenv("MINDMAP_REDUCE_ROUNDS", "4"))
+
+_HEADING_RE = re.compile(
+    r"^[ \t]*(?:#{1,6}[ \t]+\S|(?i:chapter|section|unit|part|lesson)\b|\d+(?:\.\d+)*[ \t]+[A-Z])",
+    re.MULTILINE,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _split_blocks(page: str):
+    # Section blocks start at headings; a page with none is a single block
+    starts = [m.start() for m in _HEADING_RE.finditer(page)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(page))
+    return [page[a:b] for a, b in zip(starts, starts[1:]) if page[a:b].strip()]
+
+
+def _split_oversized(block: str, budget: int):
+    limit = budget * CHARS_PER_TOKEN
+    parts, current = [], ""
+    for para in re.split(r"\n\s*\n", block):
+        while len(para) > limit:
+            parts.append(para[:limit])
+            para = para[limit:]
+        if current and len(current) + len(para) + 2 > limit:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n\n{para}" if current else para
+    if current.strip():
+        parts.append(current)
+    return parts
+
+
+class ChunkPacker:
+    # Packs pages into chunks incrementally; add() returns chunks as they fill
+    def __init__(self, budget: int = MINDMAP_CHUNK_TOKENS):
+        self.budget = budget
+        self._current = []
+        self._used = 0
+
+    def add(self, page: str):
+        done = []
+        for block in _split_blocks(page or ""):
+            pieces = _split_oversized(block, self.budget) if estimate_tokens(block) > self.budget else [block]
+            for piece in pieces:
+                cost = estimate_tokens(piece)
+                if self._current and self._used + cost > self.budget:
+                    done.append("\n".join(self._current))
+                    self._current, self._used = [], 0
+                self._current.append(piece)
+                self._used += cost
+        return done
+
+    def flush(self):
+        done = ["\n".join(self._current)] if self._current else []
+        self._current, self._used = [], 0
+        return done
+
+
+def split_text_chunks(pages, budget: int = MINDMAP_CHUNK_TOKENS):
+    packer = ChunkPacker(budget)
+    chunks = []
+    for page in pages:
+        chunks.extend(packer.add(page))
+    return chunks + packer.flush()
+
+
+async def _summarize_chunk(title, chunk, sem):
+    async with sem:
+        # The prompt embeds the chunk, so the cache key is a content hash
+        return await _acall_groq(
+            _chunk_summary_prompt(title, chunk),
+            max_tokens=MINDMAP_SUMMARY_TOKENS,
+            feature="mindmap_chunk",
+        )
+
+
+# A few failed chunks still leave a usable mindmap; if every chunk failed
+# the first error is raised. Being shed by the upstream limiter is never
+# partial: the mindmap would be cached missing those chunks.
+def _usable(results):
+    summaries = [r for r in results if isinstance(r, str) and r]
+    errors = [r for r in results if isinstance(r, Exception)]
+    limited = [e for e in errors if isinstance(e, RateLimited)]
+    if limited:
+        raise limited[0]
+    if errors and not summaries:
+        raise errors[0]
+    return summaries
+
+
+async def summarize_chunks_async(title, chunks):
+    sem = asyncio.Semaphore(MINDMAP_CONCURRENCY)
+    return _usable(await asyncio.gather(*(_summarize_chunk(title, c, sem) for c in chunks), return_exceptions=True))
+
+
+def _fit_summaries(summaries, budget: int = MINDMAP_CONTEXT_TOKENS):
+    # Trim every summary to an equal share, so no section is dropped outright
+    share = max(1, budget * CHARS_PER_TOKEN // len(summaries) - 2)
+    return "\n\n".join(s[:share] for s in summaries)
+
+
+async def _reduce_to_mindmap(title, summaries):
+    # Reduce until the merged summaries fit in one mindmap prompt. A round
+    # whose packing wouldn't shrink the list (summaries as large as a reduce
+    # chunk) is not run, and at most MINDMAP_REDUCE_ROUNDS are; what is left
+    # over is trimmed to fit.
+    budget = max(MINDMAP_CHUNK_TOKENS, 2 * MINDMAP_SUMMARY_TOKENS + 2)
+    merged = "\n\n".join(summaries)
+    for _ in range(MINDMAP_REDUCE_ROUNDS):
+        if estimate_tokens(merged) <= MINDMAP_CONTEXT_TOKENS or len(summaries) <= 1:
+            break
+        chunks = split_text_chunks(summaries, budget)
+        if len(chunks) >= len(summaries):
+            break
+        summaries = await summarize_chunks_async(title, chunks)
+        merged = "\n\n".join(summaries)
+
+    if not merged:
         return {"title": title, "children": []}
 
+    if estimate_tokens(merged) > MINDMAP_CONTEXT_TOKENS:
+        merged = _fit_summaries(summaries)
+    return _parse_mindmap(await _acall_groq(_mindmap_prompt(title, merged), feature="mindmap"), title)
 
-def extract_pdf_text(file):
-    try:
-        reader = PyPDF2.PdfReader(file)
-        return "\n".join([p.extract_text() or "" for p in reader.pages])
-    except:
-        return ""
 
+async def generate_mindmap_from_pages_async(title, pages):
+    return await _reduce_to_mindmap(title, await summarize_chunks_async(title, split_text_chunks(pages)))
 
-def notes_to_pdf_bytes(title: str, text: str):
-    buf = BytesIO()
-    pdf = canvas.Canvas(buf, pagesize=letter)
 
-    pdf.setTitle(title)
-    width, height = letter
-    y = height - 40
+# What a document's mindmap is expected to bill, for admitting it up front:
+# every chunk summarized, one reduce round if the summaries overflow a
+# prompt, then the mindmap call. Reservations settle on actual usage.
+def estimate_mindmap_tokens(title, chunks) -> int:
+    total = sum(estimate_tokens(_chunk_summary_prompt(title, c)) + MINDMAP_SUMMARY_TOKENS for c in chunks)
+    merged = len(chunks) * MINDMAP_SUMMARY_TOKENS
+    if merged > MINDMAP_CONTEXT_TOKENS:
+        total += merged + (merged // MINDMAP_CHUNK_TOKENS + 1) * MINDMAP_SUMMARY_TOKENS
+    return total + min(merged, MINDMAP_CONTEXT_TOKENS) + 3000
 
-    pdf.setFont("Helvetica-Bold", 18)
-    pdf.drawString(40, y, title)
-    y -= 30
 
-    pdf.setFont("Helvetica", 11)
-    for line in text.splitlines():
-        if y < 40:
-            pdf.showPage()
-            pdf.setFont("Helvetica", 11)
-            y = height - 40
+# ============================================================
+# PDF HELPERS
+# ============================================================
 
-        while len(line) > 95:
-            pdf.drawString(40, y, line[:95])
-            line = line[95:]
-            y -= 14
+def extract_pdf_pages(file):
+    import PyPDF2
+
+    try:
+        reader = PyPDF2.PdfReader(file)
+        return [p.extract_text() or "" for p in reader.pages]
+    except:
+        return []
 
-        pdf.drawString(40, y, line)
-        y -= 14
 
-    pdf.save()
-    buf.seek(0)
-    return buf.getvalue()
+def extract_pdf_text(file):
+    return "\n".join(extract_pdf_pages(file))
 
 
-def chat_with_tutor(message: str):
-    prompt = f"You are an AI tutor. Explain simply.\nUser: {message}"
-    return _call_groq(prompt)
+def notes_to_pdf_bytes(title: str, text: str):
+    return pdf_utils.render_notes_pdf(title, text)
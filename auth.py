@@ -1,57 +1,310 @@
 # backend/auth.py
-from passlib.context import CryptContext
-from jose import jwt, JWTError
 from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import Optional, Dict, NamedTuple
+from collections import OrderedDict
 import os
+import time
+import logging
+import uuid
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-from sqlmodel import Session, select
+from sqlalchemy import event, delete, select
+from sqlalchemy.orm import Session
 from models import User, RefreshToken
-from db import get_session, engine
+from db import SessionLocal
 
-pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# Stored hashes whose cost differs from BCRYPT_ROUNDS are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# passlib and python-jose (which loads cryptography) are ~80 ms of import
+# time, so they load on first use or in the startup warmup
+_pwd = None
+
+
+def _pwd_context():
+    global _pwd
+    if _pwd is None:
+        from passlib.context import CryptContext
+
+        _pwd = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=BCRYPT_ROUNDS,
+            bcrypt__min_rounds=BCRYPT_ROUNDS,
+            bcrypt__max_rounds=BCRYPT_ROUNDS,
+        )
+    return _pwd
+
+
+def warmup():
+    _pwd_context()
+    from jose import jwt  # noqa: F401
+
+
+# Dedicated hashing pool so login bursts don't starve the shared threadpool
+PASSWORD_POOL = os.getenv("PASSWORD_POOL", "thread")          # thread | process
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", "2"))
+PASSWORD_POOL_QUEUE = int(os.getenv("PASSWORD_POOL_QUEUE", "32"))
 
 JWT_SECRET = os.getenv("JWT_SECRET", "studyai-secret")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_EXPIRE_DAYS", "14"))
 ALGORITHM = "HS256"
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX = int(os.getenv("PRINCIPAL_CACHE_MAX", "10000"))
+REFRESH_SWEEP_INTERVAL = int(os.getenv("REFRESH_SWEEP_INTERVAL", "3600"))
+REFRESH_SWEEP_BATCH = int(os.getenv("REFRESH_SWEEP_BATCH", "5000"))
 
 def hash_password(password: str) -> str:
-    return pwd.hash(password)
+    return _pwd_context().hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
-    return pwd.verify(password, hashed)
+    return _pwd_context().verify(password, hashed)
+
+def verify_and_update_password(password: str, hashed: str):
+    return _pwd_context().verify_and_update(password, hashed)
+
+
+# ============================
+# Password hashing pool (bounded, sheds load when full)
+# ============================
+class PasswordHasherBusy(Exception):
+    pass
+
+
+_hash_executor = None
+_hash_pending = 0
+_hash_lock = threading.Lock()
+hash_pool_stats = {"completed": 0, "rejected": 0}
+
+
+def _get_hash_executor():
+    global _hash_executor
+    if _hash_executor is None:
+        if PASSWORD_POOL == "process":
+            _hash_executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=PASSWORD_POOL_WORKERS,
+                thread_name_prefix="password-hash",
+            )
+    return _hash_executor
+
+
+def _hash_done(future):
+    global _hash_pending
+    with _hash_lock:
+        _hash_pending -= 1
+        hash_pool_stats["completed"] += 1
+
+
+async def _run_in_hash_pool(fn, *args):
+    # A job stays counted until the pool is done with it, not until the
+    # caller is: a client that disconnects mid-hash must not free its slot
+    # while bcrypt is still running
+    global _hash_pending
+    with _hash_lock:
+        if _hash_pending >= PASSWORD_POOL_WORKERS + PASSWORD_POOL_QUEUE:
+            hash_pool_stats["rejected"] += 1
+            raise PasswordHasherBusy()
+        _hash_pending += 1
+
+    try:
+        future = _get_hash_executor().submit(fn, *args)
+    except BaseException:
+        _hash_done(None)
+        raise
+    # the callback runs on the pool's thread once the job finishes or is
+    # cancelled before it starts
+    future.add_done_callback(_hash_done)
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_hash_pool(hash_password, password)
+
+
+async def verify_and_update_password_async(password: str, hashed: str):
+    return await _run_in_hash_pool(verify_and_update_password, password, hashed)
+
+
+def hash_pool_snapshot():
+    return {
+        "kind": PASSWORD_POOL,
+        "workers": PASSWORD_POOL_WORKERS,
+        "queue_limit": PASSWORD_POOL_QUEUE,
+        "pending": _hash_pending,
+        **hash_pool_stats,
+    }
+
+
+def shutdown_hash_pool():
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False, cancel_futures=True)
+        _hash_executor = None
 
 def create_access_token(data: Dict, expires_minutes: Optional[int] = None):
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=(expires_minutes or ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire, "type": "access"})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
 
-def create_refresh_token(data: Dict, expires_days: Optional[int] = None):
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def create_refresh_token(data: Dict, session: Session, user_id: int, expires_days: Optional[int] = None):
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=(expires_days or REFRESH_TOKEN_EXPIRE_DAYS))
-    to_encode.update({"exp": expire, "type": "refresh"})
+    # jti keeps two tokens issued in the same second distinct under the unique index
+    to_encode.update({"exp": expire, "type": "refresh", "jti": uuid.uuid4().hex})
     token = jwt.encode(to_encode, JWT_SECRET, algorithm=ALGORITHM)
-    # store in DB
-    with Session(engine) as session:
-        user = session.query(User).filter(User.email == data.email).first()
-        if user:
-            r = RefreshToken(user_id=user.id, token=token, expires_at=expire)
-            session.add(r)
-            session.commit()
+    # store only the hash, in the caller's session
+    session.add(RefreshToken(user_id=user_id, token_hash=hash_token(token), expires_at=expire))
+    session.commit()
     return token
 
 def decode_token(token: str) -> Optional[dict]:
+    from jose import jwt, JWTError
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
         return payload
     except JWTError:
         return None
 
-def revoke_refresh_token(token: str):
-    with Session(engine) as session:
-        rt = session.exec(select(RefreshToken).where(RefreshToken.token == token)).first()
-        if rt:
-            session.delete(rt)
+def get_refresh_token(token: str, session: Session) -> Optional[RefreshToken]:
+    return session.execute(
+        select(RefreshToken).where(RefreshToken.token_hash == hash_token(token))
+    ).scalars().first()
+
+def revoke_refresh_token(token: str, session: Optional[Session] = None):
+    if session is None:
+        with SessionLocal() as own_session:
+            return revoke_refresh_token(token, own_session)
+
+    rt = get_refresh_token(token, session)
+    if rt:
+        session.delete(rt)
+        session.commit()
+        principal_cache.invalidate_user(rt.user_id)
+
+
+# ============================
+# Expired refresh-token sweeper (bulk deletes in batches)
+# ============================
+def sweep_expired_refresh_tokens(batch_size: int = REFRESH_SWEEP_BATCH) -> int:
+    total = 0
+    with SessionLocal() as session:
+        while True:
+            expired_ids = (
+                select(RefreshToken.id)
+                .where(RefreshToken.expires_at < datetime.utcnow())
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            deleted = session.execute(
+                delete(RefreshToken).where(RefreshToken.id.in_(expired_ids))
+                .execution_options(synchronize_session=False)
+            ).rowcount
             session.commit()
+            total += deleted
+            if deleted < batch_size:
+                return total
+
+async def refresh_token_sweeper(interval: int = REFRESH_SWEEP_INTERVAL):
+    while True:
+        try:
+            removed = await asyncio.to_thread(sweep_expired_refresh_tokens)
+            if removed:
+                logger.info("Swept %d expired refresh tokens", removed)
+        except Exception:
+            logger.exception("Refresh token sweep failed")
+        await asyncio.sleep(interval)
+
+
+# ============================
+# Authenticated-principal cache
+# verified access token -> (id, email), so cheap routes skip the DB
+# ============================
+class Principal(NamedTuple):
+    id: int
+    email: str
+
+
+class PrincipalCache:
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()   # token -> (expires_at, principal)
+        self._by_user = {}           # user_id -> set of tokens
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            item = self._data.get(token)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    self._drop(token)
+                self.misses += 1
+                return None
+            self._data.move_to_end(token)
+            self.hits += 1
+            return item[1]
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float] = None):
+        # Never outlive the token itself
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._drop(token)
+            self._data[token] = (expires_at, principal)
+            self._by_user.setdefault(principal.id, set()).add(token)
+            while len(self._data) > self.max_entries:
+                self._drop(next(iter(self._data)))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in self._by_user.pop(user_id, ()):
+                self._data.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_user.clear()
+
+    def _drop(self, token):
+        item = self._data.pop(token, None)
+        if item is not None:
+            tokens = self._by_user.get(item[1].id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_user[item[1].id]
+
+    def stats(self):
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_MAX, PRINCIPAL_CACHE_TTL)
+
+
+@event.listens_for(User, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
@@ -0,0 +1,293 @@
+# backend/bench.py
+# Before/after benchmarks behind the numbers quoted in commit messages.
+# Each one seeds its own data into --database-url (a throwaway SQLite file
+# by default; point it at an empty scratch Postgres to measure there):
+#
+#   python bench.py history --rows 100000
+#   python bench.py principal --requests 2000
+#   python bench.py login --concurrency 20 80
+#   python bench.py refresh-tokens --rows 1000000
+#   python bench.py history --database-url postgresql://user:pw@localhost/bench
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+FEATURES = ["notes", "quiz", "mindmap", "flashcards", "tutor"]
+
+
+def timed(fn, repeat: int):
+    # -> (median ms, p95 ms) over `repeat` calls after one warmup call
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def report(label: str, result):
+    median, p95 = result
+    print(f"  {label:<44} median {median:8.2f} ms   p95 {p95:8.2f} ms")
+
+
+def seed_users(session, count: int):
+    from sqlalchemy import insert, select
+    from models import User
+
+    now = datetime.utcnow()
+    session.execute(insert(User), [
+        {"email": f"bench{i}@example.com", "password": "x", "created_at": now} for i in range(count)
+    ])
+    session.commit()
+    return [row.id for row in session.execute(select(User.id).order_by(User.id))]
+
+
+# ============================================================
+# HISTORY COUNTS (dashboard / profile read path)
+# ============================================================
+def bench_history(args):
+    from sqlalchemy import func, insert
+    from db import SessionLocal
+    from models import History
+
+    with SessionLocal() as session:
+        target, *others = seed_users(session, 2)
+        # Half the rows belong to the measured user, half to someone else
+        start = datetime.utcnow() - timedelta(days=365)
+        for offset in range(0, args.rows, 10000):
+            session.execute(insert(History), [
+                {
+                    "user_id": target if i % 2 == 0 else others[0],
+                    "feature": random.choice(FEATURES),
+                    "details": "bench",
+                    "created_at": start + timedelta(seconds=i),
+                }
+                for i in range(offset, min(offset + 10000, args.rows))
+            ])
+        session.commit()
+
+        def per_feature_counts():
+            # Baseline: one count() per feature plus one for the total
+            {f: session.query(History).filter(History.user_id == target, History.feature == f).count()
+             for f in FEATURES}
+            session.query(History).filter(History.user_id == target).count()
+
+        def grouped_counts():
+            dict(session.query(History.feature, func.count())
+                 .filter(History.user_id == target).group_by(History.feature).all())
+
+        print(f"history: {args.rows} rows, {args.rows // 2} for the measured user")
+        report("GROUP BY feature (1 query)", timed(grouped_counts, args.repeat))
+        report("per-feature count() (6 queries)", timed(per_feature_counts, args.repeat))
+
+        # The baseline schema had no history indexes besides the primary key
+        session.close()
+        for index in History.__table__.indexes:
+            index.drop(bind=session.get_bind())
+        report("per-feature count(), baseline schema", timed(per_feature_counts, args.repeat))
+
+
+# ============================================================
+# AUTHENTICATED REQUESTS (principal cache)
+# ============================================================
+def throughput(fn, requests: int):
+    started = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    return requests / (time.perf_counter() - started)
+
+
+def bench_principal(args):
+    from fastapi.testclient import TestClient
+    from auth import create_access_token, principal_cache
+    from db import SessionLocal
+    from main import app
+
+    with SessionLocal() as session:
+        seed_users(session, 1)
+    headers = {"Authorization": "Bearer " + create_access_token({"email": "bench0@example.com"})}
+    body = {"feature": "notes", "details": "bench"}
+
+    with TestClient(app) as client:
+        def cached():
+            assert client.post("/activity/log", json=body, headers=headers).status_code == 200
+
+        def uncached():
+            # What every request paid before: JWT decode plus a users lookup
+            principal_cache.clear()
+            cached()
+
+        cached()
+        print(f"principal: {args.requests} sequential POST /activity/log with a bearer token")
+        print(f"  {'token decoded + users lookup per request':<44} {throughput(uncached, args.requests):8.0f} req/s")
+        print(f"  {'principal cache':<44} {throughput(cached, args.requests):8.0f} req/s")
+
+
+# ============================================================
+# CONCURRENT LOGINS (bcrypt pool, shedding, event-loop stalls)
+# ============================================================
+async def _login_burst(app, concurrency: int):
+    import asyncio
+    import httpx
+
+    body = {"email": "bench0@example.com", "password": "bench-password"}
+    stalls = []
+
+    async def ticker():
+        # How late a 5 ms sleep wakes up = how long something held the loop
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(0.005)
+            stalls.append((loop.time() - started - 0.005) * 1000)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(client.post("/auth/login", json=body) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        tick.cancel()
+
+    codes = [r.status_code for r in responses]
+    return codes.count(200), codes.count(503), elapsed, max(stalls, default=0.0)
+
+
+def bench_login(args):
+    import asyncio
+    from auth import BCRYPT_ROUNDS, PASSWORD_POOL_QUEUE, PASSWORD_POOL_WORKERS, hash_password
+    from db import SessionLocal
+    from main import app
+    from models import User
+
+    with SessionLocal() as session:
+        session.add(User(email="bench0@example.com", password=hash_password("bench-password"), created_at=datetime.utcnow()))
+        session.commit()
+
+    async def run():
+        await app.router.startup()
+        try:
+            print(f"login: bcrypt rounds={BCRYPT_ROUNDS}, {PASSWORD_POOL_WORKERS} workers, queue limit {PASSWORD_POOL_QUEUE}")
+            for concurrency in args.concurrency:
+                ok, shed, elapsed, stall = await _login_burst(app, concurrency)
+                print(f"  {concurrency:4} concurrent: {ok:4} ok {shed:4} shed (503)  "
+                      f"{ok / elapsed:6.1f} logins/s  longest loop stall {stall:6.1f} ms")
+        finally:
+            await app.router.shutdown()
+
+    asyncio.run(run())
+
+
+# ============================================================
+# REFRESH TOKENS (hashed + indexed lookup, revoke, expiry sweep)
+# ============================================================
+def bench_refresh_tokens(args):
+    from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, select
+    from auth import get_refresh_token, hash_token, revoke_refresh_token, sweep_expired_refresh_tokens
+    from db import SessionLocal, engine
+    from models import RefreshToken
+
+    # The baseline schema: raw token in an unindexed column
+    legacy = Table(
+        "bench_legacy_refresh_tokens", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("user_id", Integer, nullable=False),
+        Column("token", String, nullable=False),
+        Column("expires_at", DateTime),
+    )
+    legacy.create(bind=engine)
+
+    now = datetime.utcnow()
+    tokens = [f"{random.getrandbits(256):064x}.{i}" for i in range(args.rows)]
+    with SessionLocal() as session:
+        user_id = seed_users(session, 1)[0]
+        for offset in range(0, args.rows, 20000):
+            batch = tokens[offset:offset + 20000]
+            # Half already expired, for the sweep
+            expiry = [now + timedelta(days=-1 if (offset + i) % 2 else 14) for i in range(len(batch))]
+            session.execute(insert(RefreshToken), [
+                {"user_id": user_id, "token_hash": hash_token(t), "created_at": now, "expires_at": e}
+                for t, e in zip(batch, expiry)
+            ])
+            session.execute(insert(legacy), [
+                {"user_id": user_id, "token": t, "expires_at": e} for t, e in zip(batch, expiry)
+            ])
+        session.commit()
+
+        def by_hash():
+            get_refresh_token(random.choice(tokens), session)
+
+        def legacy_scan():
+            session.execute(select(legacy).where(legacy.c.token == random.choice(tokens))).first()
+
+        revocable = iter(tokens[::2])
+
+        def revoke():
+            revoke_refresh_token(next(revocable), session)
+
+        print(f"refresh tokens: {args.rows} rows")
+        report("lookup by hash (indexed)", timed(by_hash, args.repeat))
+        report("lookup by raw token, baseline schema", timed(legacy_scan, min(args.repeat, 20)))
+        report("revoke", timed(revoke, args.repeat))
+
+    started = time.perf_counter()
+    removed = sweep_expired_refresh_tokens()
+    print(f"  sweep removed {removed} expired rows in {time.perf_counter() - started:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StudyAI backend benchmarks")
+    parser.add_argument("--database-url", default=None, help="defaults to a fresh SQLite file")
+    parser.add_argument("--repeat", type=int, default=50)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    history = sub.add_parser("history", help="per-user feature counts")
+    history.add_argument("--rows", type=int, default=200000)
+    history.set_defaults(run=bench_history)
+
+    principal = sub.add_parser("principal", help="authenticated request throughput")
+    principal.add_argument("--requests", type=int, default=2000)
+    principal.set_defaults(run=bench_principal)
+
+    login = sub.add_parser("login", help="concurrent logins through the hashing pool")
+    login.add_argument("--concurrency", type=int, nargs="+", default=[20, 80])
+    login.set_defaults(run=bench_login)
+
+    refresh = sub.add_parser("refresh-tokens", help="refresh-token lookup, revoke and sweep")
+    refresh.add_argument("--rows", type=int, default=1000000)
+    refresh.set_defaults(run=bench_refresh_tokens)
+
+    args = parser.parse_args()
+
+    # db.py reads DATABASE_URL at import time, so set it before any import
+    if args.database_url is None:
+        scratch = tempfile.mkdtemp(prefix="studyai-bench-")
+        args.database_url = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("STARTUP_WARMUP", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from sqlalchemy import func, select
+    from db import SessionLocal, create_db, engine
+    from models import User
+
+    create_db()
+    # Benchmarks seed rows of their own; never mix them into real data
+    with SessionLocal() as session:
+        if session.execute(select(func.count()).select_from(User)).scalar():
+            sys.exit(f"{args.database_url} already has users; point --database-url at an empty database")
+    try:
+        args.run(args)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# backend/check_startup.py
+# Cold-start budget for `uvicorn main:app`: imports main in fresh
+# interpreters under `-X importtime` and fails if the import takes longer
+# than the budget or eagerly loads a library that is meant to be lazy.
+#
+#   python check_startup.py                 # median of 5 runs vs 900 ms
+#   python check_startup.py --budget-ms 700 --runs 9 --top 15
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "900"))
+
+# Loaded on first use or by the background warmup in main.startup()
+LAZY_MODULES = ("groq", "httpx", "PyPDF2", "reportlab", "jose", "passlib", "numpy")
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module: str = "main"):
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=here,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    # (cumulative_us, depth, name) for every module imported
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((int(m.group(2)), len(m.group(3)) // 2, m.group(4)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if importing main.py exceeds the cold-start budget")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    totals, subtree = [], []
+    for _ in range(args.runs):
+        rows = measure()
+        # Children are listed before their parent; main's subtree runs back
+        # to the previous top-level import (site and friends come first)
+        end = next(i for i, (_, depth, name) in enumerate(rows) if depth == 0 and name == "main")
+        start = end
+        while start > 0 and rows[start - 1][1] > 0:
+            start -= 1
+        subtree = rows[start:end]
+        totals.append(rows[end][0] / 1000)
+    median = statistics.median(totals)
+
+    print(f"import main: median {median:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    print("slowest imports directly under main:")
+    direct = sorted(((cum, name) for cum, depth, name in subtree if depth == 1), reverse=True)
+    for cum, name in direct[:args.top]:
+        print(f"  {cum / 1000:8.1f} ms  {name}")
+
+    failures = []
+    eager = sorted({name.split(".")[0] for _, _, name in subtree} & set(LAZY_MODULES))
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if median > args.budget_ms:
+        failures.append(f"median {median:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
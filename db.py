@@ -1,7 +1,14 @@
 import os
-from sqlalchemy import create_engine
+import hashlib
+import logging
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, select, Table, MetaData, Column, Integer, String, DateTime
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+from metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
+
 # Load DATABASE_URL (Render uses this)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./study.db")
 
@@ -11,14 +18,22 @@ if DATABASE_URL.startswith("postgres://"):
 elif DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+pg8000://", 1)
 
+# SQLite connections are opened by async routes on the event loop thread and
+# closed by FastAPI's dependency teardown in a worker thread
+connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+
 # Create engine
 engine = create_engine(
     DATABASE_URL,
     echo=False,
     future=True,
     pool_pre_ping=True,
+    connect_args=connect_args,
 )
 
+# Pool checkout wait and per-statement timings for /metrics
+instrument_engine(engine)
+
 # Create session factory
 SessionLocal = sessionmaker(
     autocommit=False,
@@ -37,6 +52,58 @@ def get_session():
     finally:
         db.close()
 
+# Refresh tokens used to be stored in plaintext in a "token" column; move
+# them to token_hash (same digest as auth.hash_token) so they keep working
+def _migrate_refresh_tokens(conn, table):
+    columns = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    if "token_hash" in columns or "token" not in columns:
+        return
+
+    legacy = Table(table.name, MetaData(), Column("id", Integer), Column("user_id", Integer),
+                   Column("token", String), Column("created_at", DateTime), Column("expires_at", DateTime))
+    rows = conn.execute(select(legacy)).fetchall()
+
+    # A token stored twice keeps the row that expires last (None = never)
+    latest = {}
+    for row in sorted((r for r in rows if r.token), key=lambda r: (r.expires_at is None, r.expires_at or datetime.min)):
+        digest = hashlib.sha256(row.token.encode("utf-8")).hexdigest()
+        latest[digest] = {"id": row.id, "user_id": row.user_id, "token_hash": digest,
+                          "created_at": row.created_at, "expires_at": row.expires_at}
+
+    conn.exec_driver_sql(f"DROP TABLE {table.name}")
+    table.create(conn)
+    if latest:
+        conn.execute(table.insert(), list(latest.values()))
+    logger.info("Migrated %d refresh tokens to token_hash (%d duplicate or empty rows dropped)",
+                len(latest), len(rows) - len(latest))
+
+
 # Create tables at startup
 def create_db():
+    import models  # registers the tables on Base.metadata
+
+    table = models.RefreshToken.__table__
+    with engine.begin() as conn:
+        if inspect(conn).has_table(table.name):
+            _migrate_refresh_tokens(conn, table)
+
     Base.metadata.create_all(bind=engine)
+
+    # create_all() skips tables that already exist, so indexes added to an
+    # existing model (e.g. history's composite index) are created here.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                logger.warning("Index %s not created: %s", index.name, e)
+
+    # user_feature_stats starts empty on a deployment that already has
+    # history; backfill it once so the dashboard doesn't read zeros
+    with SessionLocal() as session:
+        if session.query(models.UserFeatureStat.user_id).first() is None \
+                and session.query(models.History.id).first() is not None:
+            from activity import rebuild_feature_stats
+
+            rows = rebuild_feature_stats(session)
+            logger.info("Backfilled %d user_feature_stats rows from history", rows)
@@ -0,0 +1,237 @@
+# backend/fake_llm_server.py
+# Local stand-in for the Groq/OpenAI chat completions API, for running and
+# load-testing the backend with no network:
+#
+#   python fake_llm_server.py --port 8001 --latency lognormal:300,0.5 --tps 200 --error-rate 0.02
+#   AI_BACKEND=openai AI_BASE_URL=http://127.0.0.1:8001/v1 uvicorn main:app
+#
+# The Groq SDK can also be pointed here (base_url=http://127.0.0.1:8001);
+# both /v1 and /openai/v1 prefixes are served.
+import os
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+# ============================================================
+# CONFIG (env defaults, CLI flags, or POST /admin/config at runtime)
+# ============================================================
+config = {
+    # time to first token: fixed:MS | uniform:MIN_MS,MAX_MS | exp:MEAN_MS | lognormal:MEDIAN_MS,SIGMA
+    "latency": os.getenv("FAKE_LLM_LATENCY", "lognormal:300,0.5"),
+    "tokens_per_second": float(os.getenv("FAKE_LLM_TPS", "200")),
+    "output_tokens": int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", "400")),
+    "error_rate": float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+    "error_codes": [int(c) for c in os.getenv("FAKE_LLM_ERROR_CODES", "429,500,503").split(",")],
+    "retry_after": float(os.getenv("FAKE_LLM_RETRY_AFTER", "1")),
+}
+
+stats = {"requests": 0, "streams": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+
+app = FastAPI(title="Fake LLM server")
+
+
+def sample_latency(spec: str) -> float:
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        ms = values[0]
+    elif kind == "uniform":
+        ms = random.uniform(values[0], values[1])
+    elif kind == "exp":
+        ms = random.expovariate(1 / values[0])
+    elif kind == "lognormal":
+        ms = random.lognormvariate(math.log(values[0]), values[1])
+    else:
+        raise ValueError(f"Unknown latency distribution {spec!r}")
+    return ms / 1000
+
+
+# ============================================================
+# CANNED CONTENT (shaped so the backend's parsers accept it)
+# ============================================================
+_WORDS = ("concept definition example process energy system structure function "
+          "cycle model theory evidence factor result method principle").split()
+
+
+def _topic(prompt: str) -> str:
+    start = prompt.find("**")
+    end = prompt.find("**", start + 2)
+    return prompt[start + 2:end] if start != -1 and end != -1 else "the topic"
+
+
+def _prose(n_tokens: int) -> str:
+    lines, words = [], []
+    for i in range(n_tokens):
+        words.append(random.choice(_WORDS))
+        if len(words) >= 12:
+            lines.append("- " + " ".join(words))
+            words = []
+    if words:
+        lines.append("- " + " ".join(words))
+    return "\n".join(lines)
+
+
+def fake_completion(prompt: str, max_tokens: int) -> str:
+    n = min(max_tokens, config["output_tokens"])
+    topic = _topic(prompt)
+    lower = prompt.lower()
+
+    if "hierarchical mindmap" in lower:
+        return json.dumps({
+            "title": topic,
+            "children": [
+                {"title": f"Branch {i + 1}", "children": [{"title": f"Leaf {i + 1}.{j + 1}", "children": []} for j in range(3)]}
+                for i in range(4)
+            ],
+        })
+    if "mcqs" in lower:
+        return json.dumps([
+            {
+                "q": f"Question {i + 1} about {topic}?",
+                "options": {"A": "Option A", "B": "Option B", "C": "Option C", "D": "Option D"},
+                "answer": "ABCD"[i % 4],
+            }
+            for i in range(10)
+        ])
+    if "flashcards for" in lower:
+        count = next((int(w) for w in prompt.split() if w.isdigit()), 8)
+        return json.dumps([{"q": f"Term {i + 1} of {topic}?", "a": _prose(12)} for i in range(count)])
+    return f"# {topic}\n\n" + _prose(n)
+
+
+def _tokens(text: str):
+    # ~4 characters per token, matching ai_utils.CHARS_PER_TOKEN
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+def _error_response():
+    code = random.choice(config["error_codes"])
+    stats["errors"] += 1
+    headers = {"Retry-After": str(config["retry_after"])} if code == 429 else {}
+    body = {"error": {"message": f"Injected error {code}", "type": "fake_error", "code": code}}
+    return JSONResponse(status_code=code, content=body, headers=headers)
+
+
+# ============================================================
+# CHAT COMPLETIONS
+# ============================================================
+async def chat_completions(body: dict = Body(...)):
+    stats["requests"] += 1
+    if random.random() < config["error_rate"]:
+        return _error_response()
+
+    prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+    model = body.get("model", "fake-model")
+    text = fake_completion(prompt, int(body.get("max_tokens") or 1024))
+    tokens = _tokens(text)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    usage = {
+        "prompt_tokens": len(prompt) // 4 + 1,
+        "completion_tokens": len(tokens),
+        "total_tokens": len(prompt) // 4 + 1 + len(tokens),
+    }
+
+    if not body.get("stream"):
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(sample_latency(config["latency"]) + len(tokens) / config["tokens_per_second"])
+        finally:
+            stats["in_flight"] -= 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    def chunk(delta, finish_reason=None, **extra):
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            **extra,
+        }) + "\n\n"
+
+    async def events():
+        stats["streams"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(sample_latency(config["latency"]))
+            yield chunk({"role": "assistant", "content": ""})
+            # Emit in ~20ms batches so the event loop isn't flooded with sleeps
+            per_batch = max(1, int(config["tokens_per_second"] * 0.02))
+            for i in range(0, len(tokens), per_batch):
+                yield chunk({"content": "".join(tokens[i:i + per_batch])})
+                await asyncio.sleep(per_batch / config["tokens_per_second"])
+            # Groq reports usage on the final chunk under x_groq
+            yield chunk({}, "stop", x_groq={"id": completion_id, "usage": usage})
+            yield "data: [DONE]\n\n"
+        finally:
+            stats["in_flight"] -= 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+for prefix in ("/v1", "/openai/v1"):
+    app.post(f"{prefix}/chat/completions")(chat_completions)
+
+
+@app.get("/v1/models")
+def models():
+    return {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "local"}]}
+
+
+@app.get("/admin/stats")
+def admin_stats():
+    return {"config": config, **stats}
+
+
+@app.post("/admin/config")
+def admin_config(payload: dict = Body(...)):
+    unknown = set(payload) - set(config)
+    if unknown:
+        return JSONResponse(status_code=400, content={"detail": f"Unknown keys: {sorted(unknown)}"})
+    if "latency" in payload:
+        sample_latency(payload["latency"])   # validate before applying
+    config.update(payload)
+    return config
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Groq/OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default=config["latency"])
+    parser.add_argument("--tps", type=float, default=config["tokens_per_second"])
+    parser.add_argument("--output-tokens", type=int, default=config["output_tokens"])
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"])
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    sample_latency(args.latency)
+    config.update(
+        latency=args.latency,
+        tokens_per_second=args.tps,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,338 @@
+# backend/jobs.py
+import os
+import logging
+import json
+import time
+import uuid
+import asyncio
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+
+from db import SessionLocal
+from models import Job
+from ratelimit import user_limiter
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PENDING_PER_USER = int(os.getenv("JOB_MAX_PENDING_PER_USER", "5"))
+JOB_RETENTION_HOURS = int(os.getenv("JOB_RETENTION_HOURS", "24"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))
+JOB_SWEEP_INTERVAL = int(os.getenv("JOB_SWEEP_INTERVAL", "300"))
+
+FINISHED = ("done", "failed")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _ms(start, end):
+    return round((end - start).total_seconds() * 1000, 1)
+
+
+def job_view(job) -> dict:
+    now = datetime.utcnow()
+    view = {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "queue_wait_ms": _ms(job.created_at, job.started_at or now),
+        "run_ms": _ms(job.started_at, job.finished_at or now) if job.started_at else None,
+    }
+    if job.status == "done":
+        view["result"] = json.loads(job.result)
+    elif job.status == "failed":
+        view["error"] = job.error
+    return view
+
+
+# ============================================================
+# JOB QUEUE
+# Jobs are rows in the jobs table; this process keeps a per-user
+# round-robin of queued ids so one user's burst can't starve others,
+# and JOB_WORKERS tasks cap how many generations run at once.
+# ============================================================
+class JobQueue:
+    def __init__(self, session_factory, workers: int, max_pending_per_user: int,
+                 retention_hours: int, stale_seconds: int, sweep_interval: int):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.max_pending_per_user = max_pending_per_user
+        self.retention = timedelta(hours=retention_hours)
+        self.stale = timedelta(seconds=stale_seconds)
+        self.sweep_interval = sweep_interval
+        self.handlers = {}
+
+        self._pending = OrderedDict()   # user_id -> deque of job ids, in round-robin order
+        self._active = Counter()        # user_id -> queued + running in this process
+        self._ready = None              # counts ids sitting in _pending
+        self._finished = None           # notified whenever a job finishes here
+        self._tasks = []
+
+        self.running_jobs = 0
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+        self._total_wait_ms = 0.0
+        self._total_run_ms = 0.0
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def handler(self, kind: str):
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    async def start(self):
+        if self.running:
+            return
+        self._ready = asyncio.Semaphore(0)
+        self._finished = asyncio.Condition()
+        self._pending.clear()
+        self._active.clear()
+
+        for user_id, job_id in await asyncio.to_thread(self._recover, True):
+            self._push(user_id, job_id)
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        # Cancelled workers hand their job back to the queue (see _run_job)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(self, user_id: int, kind: str, payload: dict) -> str:
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        if self._active[user_id] >= self.max_pending_per_user:
+            raise JobQueueFull(f"At most {self.max_pending_per_user} jobs may be pending per user")
+
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, {
+            "id": job_id,
+            "user_id": user_id,
+            "kind": kind,
+            "status": "queued",
+            "payload": json.dumps(payload),
+            "created_at": datetime.utcnow(),
+        })
+        # Not started (e.g. no startup event): the row is picked up on next start()
+        if self.running:
+            self._push(user_id, job_id)
+        return job_id
+
+    def fetch(self, job_id: str, user_id: int):
+        with self.session_factory() as session:
+            job = session.get(Job, job_id)
+            if job is None or job.user_id != user_id:
+                return None
+            return job_view(job)
+
+    # Wakes on a local finish or after `timeout`, so subscribers also see
+    # jobs that another worker process completed.
+    async def wait(self, timeout: float):
+        if self._finished is None:
+            await asyncio.sleep(timeout)
+            return
+        async with self._finished:
+            try:
+                await asyncio.wait_for(self._finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    # ---------- scheduling ----------
+    def _push(self, user_id, job_id):
+        self._pending.setdefault(user_id, deque()).append(job_id)
+        self._active[user_id] += 1
+        self._ready.release()
+
+    def _next(self):
+        user_id, queue = self._pending.popitem(last=False)
+        job_id = queue.popleft()
+        if queue:
+            self._pending[user_id] = queue   # back of the line behind other users
+        return user_id, job_id
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            user_id, job_id = self._next()
+            try:
+                await self._run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker error")
+            finally:
+                self._active[user_id] -= 1
+                if self._active[user_id] <= 0:
+                    del self._active[user_id]
+
+    async def _run_job(self, job_id):
+        claimed = await asyncio.to_thread(self._claim, job_id)
+        if claimed is None:
+            return   # finished, deleted, or claimed by another process
+        user_id, kind, payload, created_at, started_at = claimed
+
+        self.running_jobs += 1
+        began = time.perf_counter()
+        result, error = None, None
+        try:
+            # Admitted when submitted; what the job bills is debited as it runs
+            async with user_limiter.metered(user_id, kind):
+                result = await self.handlers[kind](user_id, json.loads(payload))
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self._requeue, job_id)
+            raise
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        finally:
+            self.running_jobs -= 1
+
+        if error is None:
+            await asyncio.to_thread(self._finish, job_id, "done", json.dumps(result), None)
+            self.completed += 1
+        else:
+            await asyncio.to_thread(self._finish, job_id, "failed", None, error)
+            self.failed += 1
+        self._total_wait_ms += _ms(created_at, started_at)
+        self._total_run_ms += (time.perf_counter() - began) * 1000
+
+        async with self._finished:
+            self._finished.notify_all()
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                for user_id, job_id in await asyncio.to_thread(self._recover, False):
+                    self._push(user_id, job_id)
+                removed = await asyncio.to_thread(self._sweep)
+                if removed:
+                    logger.info("Swept %d finished jobs", removed)
+            except Exception:
+                logger.exception("Job sweep failed")
+
+    # ---------- DB (called via asyncio.to_thread) ----------
+    def _insert(self, row):
+        with self.session_factory() as session:
+            session.execute(insert(Job), [row])
+            session.commit()
+
+    # Conditional UPDATE so only one worker process ever runs a given job
+    def _claim(self, job_id):
+        now = datetime.utcnow()
+        with self.session_factory() as session:
+            claimed = session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "queued")
+                .values(status="running", started_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            session.commit()
+            if not claimed:
+                return None
+            row = session.execute(
+                select(Job.user_id, Job.kind, Job.payload, Job.created_at).where(Job.id == job_id)
+            ).first()
+        return row.user_id, row.kind, row.payload, row.created_at, now
+
+    def _finish(self, job_id, status, result, error):
+        with self.session_factory() as session:
+            session.execute(
+                update(Job)
+                .where(Job.id == job_id)
+                .values(status=status, result=result, error=error, finished_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+    def _requeue(self, job_id):
+        with self.session_factory() as session:
+            session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "running")
+                .values(status="queued", started_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+    # Jobs left "running" by a crashed process go back to the queue once
+    # stale; on startup every queued job is loaded as well.
+    def _recover(self, include_queued: bool):
+        stale_before = datetime.utcnow() - self.stale
+        with self.session_factory() as session:
+            stale = [
+                (r.user_id, r.id) for r in session.execute(
+                    select(Job.user_id, Job.id)
+                    .where(Job.status == "running", Job.started_at < stale_before)
+                    .order_by(Job.created_at)
+                )
+            ]
+            if stale:
+                session.execute(
+                    update(Job)
+                    .where(Job.id.in_([job_id for _, job_id in stale]), Job.status == "running")
+                    .values(status="queued", started_at=None)
+                    .execution_options(synchronize_session=False)
+                )
+                session.commit()
+            self.recovered += len(stale)
+            if not include_queued:
+                return stale
+
+            return [
+                (r.user_id, r.id) for r in session.execute(
+                    select(Job.user_id, Job.id)
+                    .where(Job.status == "queued")
+                    .order_by(Job.created_at)
+                )
+            ]
+
+    def _sweep(self) -> int:
+        cutoff = datetime.utcnow() - self.retention
+        with self.session_factory() as session:
+            removed = session.execute(
+                delete(Job)
+                .where(Job.status.in_(FINISHED), Job.finished_at < cutoff)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            session.commit()
+        return removed
+
+    def stats(self):
+        finished = self.completed + self.failed
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "queued": sum(len(q) for q in self._pending.values()),
+            "users_waiting": len(self._pending),
+            "in_progress": self.running_jobs,
+            "completed": self.completed,
+            "failed": self.failed,
+            "recovered": self.recovered,
+            "avg_queue_wait_ms": round(self._total_wait_ms / finished, 1) if finished else 0.0,
+            "avg_run_ms": round(self._total_run_ms / finished, 1) if finished else 0.0,
+        }
+
+
+job_queue = JobQueue(
+    SessionLocal,
+    workers=JOB_WORKERS,
+    max_pending_per_user=JOB_MAX_PENDING_PER_USER,
+    retention_hours=JOB_RETENTION_HOURS,
+    stale_seconds=JOB_STALE_SECONDS,
+    sweep_interval=JOB_SWEEP_INTERVAL,
+)
@@ -7,22 +7,55 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Body
+import io
+import logging
+import time
+import asyncio
+import csv
+import hmac
+import json
+from contextlib import aclosing
+from datetime import datetime
+from typing import Optional
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, UploadFile, File, Body, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
-from io import BytesIO
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, Response, JSONResponse, PlainTextResponse
+import anyio
 from sqlalchemy.orm import Session
 
 # Local imports
-from db import create_db, get_session
+from db import create_db, get_session, SessionLocal, engine
 from models import User, History
-from auth import decode_token
+from activity import history_writer, feature_counts, history_page, iter_history, InvalidCursor
+from jobs import job_queue, JobQueueFull, FINISHED
+from tutor import tutor_sessions
+from auth import (
+    decode_token,
+    principal_cache,
+    Principal,
+    hash_pool_snapshot,
+    shutdown_hash_pool,
+    refresh_token_sweeper,
+    warmup as auth_warmup,
+)
+import ai_cache
 import ai_utils
+import metrics
+from ai_resilience import AIError, upstream_policy
+from ratelimit import RateLimited, FEATURE_COSTS, user_limiter, upstream_limiter
+import pdf_utils
+import topic_index
+from ai_cache import pdf_text_cache, pdf_mindmap_cache, pdf_render_cache
 
 # Auth router
 from routes_auth import router as auth_router
 
+# Background tasks and startup report through logging, in uvicorn's format
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(levelname)s:     %(name)s - %(message)s")
+logger = logging.getLogger(__name__)
+
 
 # ===============================
 # APP INIT
@@ -30,6 +63,14 @@ from routes_auth import router as auth_router
 app = FastAPI(title="StudyAI Backend")
 
 security = HTTPBearer()
+ops_security = HTTPBearer(auto_error=False)
+
+HISTORY_PAGE_MAX = 200
+JOB_EVENTS_POLL_SECONDS = float(os.getenv("JOB_EVENTS_POLL_SECONDS", "2"))
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+STARTUP_WARMUP_DELAY = float(os.getenv("STARTUP_WARMUP_DELAY", "0.5"))   # let the health check in first
+# Bearer token for /ops/stats and /metrics; unset keeps them switched off
+OPS_TOKEN = os.getenv("OPS_TOKEN", "")
 
 
 # ===============================
@@ -53,6 +94,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so latency includes CORS and error handling
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+# ===============================
+# UPSTREAM AI ERRORS -> HTTP
+# 503 rate-limited / unavailable / circuit open, 504 timeout, 502 otherwise
+# ===============================
+@app.exception_handler(AIError)
+async def ai_error_handler(request, exc: AIError):
+    headers = {}
+    if exc.retry_after is not None:
+        headers["Retry-After"] = str(max(1, int(exc.retry_after + 0.5)))
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=headers)
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request, exc: RateLimited):
+    headers = {"Retry-After": str(max(1, int(exc.retry_after + 0.999)))}
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers=headers)
+
 
 # ===============================
 # INCLUDE AUTH ROUTES
@@ -61,16 +123,63 @@ app.include_router(auth_router)
 
 
 # ===============================
-# DATABASE INIT
+# STARTUP
+# uvicorn binds the port only after startup returns. Schema setup runs
+# first, since every DB-backed route and worker needs the tables; loading
+# the heavy libraries (LLM SDK, PyPDF2/reportlab, jose/passlib, numpy)
+# runs in the background.
 # ===============================
 @app.on_event("startup")
-def startup():
+async def startup():
+    started = time.perf_counter()
     try:
-        create_db()
-        print("Database Initialized Successfully")
-    except Exception as e:
-        print("DB Error ->", e)
+        await asyncio.to_thread(create_db)
+        logger.info("Database initialized (%.0f ms)", (time.perf_counter() - started) * 1000)
+    except Exception:
+        logger.exception("Database initialization failed")
 
+    await history_writer.start()
+    try:
+        await job_queue.start()
+    except Exception:
+        logger.exception("Job queue failed to start")
+    app.state.refresh_sweeper = asyncio.create_task(refresh_token_sweeper())
+    app.state.tutor_sweeper = asyncio.create_task(tutor_sessions.sweeper())
+    app.state.warmup = asyncio.create_task(warmup()) if STARTUP_WARMUP else None
+
+
+async def warmup():
+    await asyncio.sleep(STARTUP_WARMUP_DELAY)
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(auth_warmup)
+        await asyncio.to_thread(ai_utils.warmup)
+        await asyncio.to_thread(topic_index.warmup)
+        await pdf_utils.warmup()
+        logger.info("Warmup done (%.0f ms)", (time.perf_counter() - started) * 1000)
+    except Exception:
+        logger.exception("Warmup failed")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    task = app.state.warmup
+    if task is not None and not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    for name in ("refresh_sweeper", "tutor_sweeper"):
+        sweeper = getattr(app.state, name, None)
+        if sweeper is not None:
+            sweeper.cancel()
+
+    # Running jobs are handed back to the queue and resume after restart
+    await job_queue.stop()
+    await tutor_sessions.stop()
+    # Flush any queued History rows before the worker exits
+    await history_writer.stop()
+    await ai_utils.aclose()
+    shutdown_hash_pool()
+    pdf_utils.shutdown_pool()
 
 
 # ===============================
@@ -78,20 +187,117 @@ def startup():
 # ===============================
 def get_current_user(
     creds: HTTPAuthorizationCredentials = Depends(security),
-    session: Session = Depends(get_session),
-) -> User:
+) -> Principal:
     token = creds.credentials
+
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     payload = decode_token(token)
 
     if not payload or payload.get("type") != "access":
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    user = session.query(User).filter(User.email == payload["email"]).first()
+    with SessionLocal() as session:
+        row = session.query(User.id, User.email).filter(User.email == payload["email"]).first()
 
-    if not user:
+    if not row:
         raise HTTPException(status_code=401, detail="User not found")
 
-    return user
+    principal = Principal(id=row.id, email=row.email)
+    principal_cache.put(token, principal, payload.get("exp"))
+    return principal
+
+
+# Per-user token budget for AI routes: the feature's expected cost is
+# reserved up front and settled once the response (stream included) has
+# been sent, so requests served from cache give it all back
+def admit(feature: str):
+    async def dependency(user: Principal = Depends(get_current_user)):
+        reservation = await user_limiter.reserve(user.id, feature)
+        try:
+            yield user
+        finally:
+            await user_limiter.settle(reservation)
+    return dependency
+
+
+# ===============================
+# SSE HELPERS
+# ===============================
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# The first delta is pulled before the response starts, so failing to get
+# an upstream slot or open the stream (shed, circuit open, timeout) raises
+# here and gets the same status and Retry-After as the JSON routes; once
+# the 200 is out, a failure can only be reported as an error event.
+async def _first(source):
+    try:
+        return [await source.__anext__()]
+    except StopAsyncIteration:
+        return []
+    except BaseException:
+        await source.aclose()
+        raise
+
+
+async def _resume(head, source):
+    for item in head:
+        yield item
+    async for item in source:
+        yield item
+
+
+# on_complete(text) runs only once the upstream stream has finished. On client
+# disconnect Starlette cancels the generator, which closes `deltas` and with it
+# the upstream request.
+async def sse_response(deltas, on_complete):
+    head = await _first(deltas)
+
+    async def events():
+        parts = []
+        try:
+            async for delta in _resume(head, deltas):
+                parts.append(delta)
+                yield _sse("delta", {"text": delta})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        finally:
+            await deltas.aclose()
+
+        await on_complete("".join(parts))
+        yield _sse("done", {})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+# Same contract as sse_response, but for whole JSON items (quiz/flashcards).
+# `prime=False` starts the response at once, for sources that report their
+# own failures as items (pack).
+async def ndjson_response(items, on_complete, prime: bool = True):
+    head = await _first(items) if prime else []
+
+    async def lines():
+        sent = []
+        try:
+            async for item in _resume(head, items):
+                sent.append(item)
+                yield json.dumps({"event": "item", "data": item}) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+            return
+        finally:
+            await items.aclose()
+
+        await on_complete(sent)
+        yield json.dumps({"event": "done", "count": len(sent)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
 
 
 # ===============================
@@ -102,27 +308,108 @@ def root():
     return {"status": "Backend running", "ok": True}
 
 
+# ===============================
+# OPS STATS
+# ===============================
+def require_ops(creds: Optional[HTTPAuthorizationCredentials] = Depends(ops_security)):
+    if not OPS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if creds is None or not hmac.compare_digest(creds.credentials.encode(), OPS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid ops token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+@app.get("/ops/stats", dependencies=[Depends(require_ops)])
+def ops_stats():
+    return {
+        "ai_upstream": upstream_policy.stats(),
+        "rate_limit": user_limiter.stats(),
+        "upstream_limiter": upstream_limiter.stats(),
+        "ai_cache": ai_utils.response_cache.stats(),
+        "single_flight": ai_utils.single_flight.stats(),
+        "topic_index": topic_index.topic_index.stats(),
+        "pdf_text_cache": pdf_text_cache.stats(),
+        "pdf_mindmap_cache": pdf_mindmap_cache.stats(),
+        "pdf_render_cache": pdf_render_cache.stats(),
+        "history_writer": history_writer.stats(),
+        "jobs": job_queue.stats(),
+        "tutor": tutor_sessions.stats(),
+        "principal_cache": principal_cache.stats(),
+        "password_pool": hash_pool_snapshot(),
+    }
+
+
+# ===============================
+# PROMETHEUS METRICS
+# Saturation gauges are sampled at scrape time, off the hot path.
+# ===============================
+def _threadpool_samples():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    samples = {
+        ("anyio", "in_use"): limiter.borrowed_tokens,
+        ("anyio", "limit"): limiter.total_tokens,
+    }
+    # asyncio.to_thread() runs on the loop's default executor
+    executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+    if executor is not None:
+        samples[("default_executor", "threads")] = len(executor._threads)
+        samples[("default_executor", "limit")] = executor._max_workers
+        samples[("default_executor", "queued")] = executor._work_queue.qsize()
+    password = hash_pool_snapshot()
+    samples[("password", "in_use")] = password["pending"]
+    samples[("password", "limit")] = password["workers"]
+    return samples
+
+
+def _queue_samples():
+    jobs = job_queue.stats()
+    return {
+        ("history_writer",): history_writer.stats()["queue_depth"],
+        ("jobs_queued",): jobs["queued"],
+        ("jobs_running",): jobs["in_progress"],
+        ("upstream_waiting",): upstream_limiter.waiting(),
+    }
+
+
+def _db_pool_samples():
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {}   # e.g. NullPool for file-backed SQLite
+    return {("checked_out",): pool.checkedout(), ("size",): pool.size()}
+
+
+metrics.Gauge("threadpool_usage", "Worker pool occupancy and limits", ("pool", "kind"), _threadpool_samples)
+metrics.Gauge("queue_depth", "Background queue depths", ("queue",), _queue_samples)
+metrics.Gauge("db_pool_connections", "DB connection pool occupancy", ("state",), _db_pool_samples)
+
+
+@app.get("/metrics", dependencies=[Depends(require_ops)])
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # ===============================
 # PROFILE ROUTE
 # ===============================
 @app.get("/profile")
 def profile(
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
-    total_notes = session.query(History).filter(History.user_id == user.id, History.feature == "notes").count()
-    total_flash = session.query(History).filter(History.user_id == user.id, History.feature == "flashcards").count()
-    total_quiz = session.query(History).filter(History.user_id == user.id, History.feature == "quiz").count()
-    total_tutor = session.query(History).filter(History.user_id == user.id, History.feature == "tutor").count()
+    account = session.get(User, user.id)
+    if not account:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    counts = feature_counts(session, user.id)
 
     return {
-        "email": user.email,
-        "created_at": user.created_at,
+        "email": account.email,
+        "created_at": account.created_at,
         "stats": {
-            "notes": total_notes,
-            "flashcards": total_flash,
-            "quiz": total_quiz,
-            "tutor": total_tutor,
+            "notes": counts.get("notes", 0),
+            "flashcards": counts.get("flashcards", 0),
+            "quiz": counts.get("quiz", 0),
+            "tutor": counts.get("tutor", 0),
         }
     }
 
@@ -131,10 +418,9 @@ def profile(
 # ACTIVITY LOG
 # ===============================
 @app.post("/activity/log")
-def log_activity(
+async def log_activity(
     payload: dict = Body(...),
-    user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    user: Principal = Depends(get_current_user),
 ):
     feature = payload.get("feature")
     details = payload.get("details", "")
@@ -142,12 +428,9 @@ def log_activity(
     if not feature:
         raise HTTPException(status_code=400, detail="Feature required")
 
-    h = History(user_id=user.id, feature=feature, details=details)
-    session.add(h)
-    session.commit()
-    session.refresh(h)
+    await history_writer.enqueue(user.id, feature, details)
 
-    return {"status": "ok", "id": h.id}
+    return {"status": "ok"}
 
 
 # ===============================
@@ -156,19 +439,78 @@ def log_activity(
 @app.get("/activity/history")
 def get_history(
     limit: int = 20,
-    user: User = Depends(get_current_user),
+    cursor: Optional[str] = None,
+    feature: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user: Principal = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
-    q = session.query(History).filter(
-        History.user_id == user.id
-    ).order_by(History.created_at.desc()).limit(limit).all()
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    try:
+        rows, next_cursor = history_page(
+            session, user.id, limit, cursor,
+            feature=feature, since=since, until=until,
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
     return {
         "history": [
-            {"feature": r.feature, "details": r.details, "created_at": r.created_at}
-            for r in q
-        ]
+            {"id": r.id, "feature": r.feature, "details": r.details, "created_at": r.created_at}
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+# ===============================
+# ACTIVITY EXPORT (NDJSON / CSV, constant memory)
+# ===============================
+@app.get("/activity/export")
+def export_history(
+    format: str = "ndjson",
+    feature: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user: Principal = Depends(get_current_user),
+):
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+
+    rows = iter_history(user.id, feature=feature, since=since, until=until)
+
+    def ndjson_lines():
+        for r in rows:
+            yield json.dumps({
+                "id": r.id,
+                "feature": r.feature,
+                "details": r.details,
+                "created_at": r.created_at.isoformat() if r.created_at else None,
+            }) + "\n"
+
+    def csv_lines():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["id", "feature", "details", "created_at"])
+        for r in rows:
+            writer.writerow([r.id, r.feature, r.details, r.created_at.isoformat() if r.created_at else ""])
+            if buf.tell() >= 64 * 1024:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    if format == "csv":
+        body, media_type = csv_lines(), "text/csv"
+    else:
+        body, media_type = ndjson_lines(), "application/x-ndjson"
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="history.{format}"',
+        "Access-Control-Expose-Headers": "Content-Disposition",
     }
+    return StreamingResponse(body, media_type=media_type, headers=headers)
 
 
 # ===============================
@@ -176,19 +518,14 @@ def get_history(
 # ===============================
 @app.get("/dashboard/stats")
 def dashboard_stats(
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
     FEATURES = ["notes", "quiz", "mindmap", "flashcards", "tutor"]
 
-    per_feature = {
-        f: session.query(History)
-            .filter(History.user_id == user.id, History.feature == f)
-            .count()
-        for f in FEATURES
-    }
-
-    total_entries = session.query(History).filter(History.user_id == user.id).count()
+    counts = feature_counts(session, user.id)
+    per_feature = {f: counts.get(f, 0) for f in FEATURES}
+    total_entries = sum(counts.values())
 
     recent = session.query(History).filter(
         History.user_id == user.id
@@ -204,164 +541,511 @@ def dashboard_stats(
     }
 
 
+# ===============================
+# BACKGROUND JOBS (POST /ai/*?async=1)
+# ===============================
+async def submit_job(user: Principal, kind: str, payload: dict):
+    try:
+        job_id = await job_queue.submit(user.id, kind, payload)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job_id,
+            "status": "queued",
+            "poll": f"/jobs/{job_id}",
+            "events": f"/jobs/{job_id}/events",
+        },
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, user: Principal = Depends(get_current_user)):
+    view = await asyncio.to_thread(job_queue.fetch, job_id, user.id)
+    if view is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return view
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, user: Principal = Depends(get_current_user)):
+    first = await asyncio.to_thread(job_queue.fetch, job_id, user.id)
+    if first is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        view, last_status = first, None
+        while True:
+            if view["status"] != last_status:
+                last_status = view["status"]
+                if last_status in FINISHED:
+                    yield _sse(last_status, jsonable_encoder(view))
+                    return
+                yield _sse("status", jsonable_encoder(view))
+            await job_queue.wait(JOB_EVENTS_POLL_SECONDS)
+            view = await asyncio.to_thread(job_queue.fetch, job_id, user.id)
+            if view is None:
+                yield _sse("error", {"detail": "Job not found"})
+                return
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
 # ===============================
 # AI – NOTES
 # ===============================
+@job_queue.handler("notes")
+async def run_notes(user_id: int, payload: dict):
+    topic = payload.get("topic", "")
+    output = await ai_utils.generate_notes_async(topic)
+
+    await history_writer.enqueue(user_id, "notes", topic)
+
+    return {"notes": output}
+
+
 @app.post("/ai/notes")
-def ai_notes(
+async def ai_notes(
+    payload: dict = Body(...),
+    run_async: bool = Query(False, alias="async"),
+    user: Principal = Depends(admit("notes"))
+):
+    if run_async:
+        return await submit_job(user, "notes", payload)
+    return await run_notes(user.id, payload)
+
+
+@app.post("/ai/notes/stream")
+async def ai_notes_stream(
     payload: dict = Body(...),
-    session: Session = Depends(get_session),
-    user: User = Depends(get_current_user)
+    user: Principal = Depends(admit("notes"))
 ):
     topic = payload.get("topic", "")
-    output = ai_utils.generate_notes(topic)
 
-    session.add(History(user_id=user.id, feature="notes", details=topic))
-    session.commit()
+    async def record(_text):
+        await history_writer.enqueue(user.id, "notes", topic)
 
-    return {"notes": output}
+    return await sse_response(ai_utils.stream_notes(topic), record)
 
 
 # ===============================
 # DOWNLOAD NOTES AS PDF
 # ===============================
 @app.post("/notes/pdf")
-def notes_pdf(payload: dict = Body(...), user: User = Depends(get_current_user)):
+async def notes_pdf(
+    payload: dict = Body(...),
+    if_none_match: Optional[str] = Header(None),
+    user: Principal = Depends(get_current_user)
+):
     title = payload.get("title", "notes")
     notes = payload.get("notes")
 
     if not notes:
         raise HTTPException(status_code=400, detail="Notes required")
 
-    pdf_bytes = ai_utils.notes_to_pdf_bytes(title, notes)
-
+    # Same (title, notes) always renders the same document, so the hash
+    # doubles as a strong ETag and a client revalidation skips rendering.
+    key = pdf_utils.notes_cache_key(title, notes)
+    etag = f'"{key}"'
     headers = {
+        "ETag": etag,
         "Content-Disposition": f'attachment; filename="{title}.pdf"',
-        "Access-Control-Expose-Headers": "Content-Disposition",
+        "Access-Control-Expose-Headers": "Content-Disposition, ETag",
     }
 
-    return StreamingResponse(BytesIO(pdf_bytes), media_type="application/pdf", headers=headers)
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    pdf_bytes = await pdf_render_cache.aget("notes_pdf", key)
+    if pdf_bytes is None:
+        pdf_bytes = await pdf_utils.render_notes_pdf_async(title, notes)
+        await pdf_render_cache.aset("notes_pdf", key, pdf_bytes)
+
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
 
 
 # ===============================
 # AI – FLASHCARDS
 # ===============================
+@job_queue.handler("flashcards")
+async def run_flashcards(user_id: int, payload: dict):
+    topic = payload.get("topic", "")
+    count = int(payload.get("count", 8))
+
+    cards = await ai_utils.generate_flashcards_async(topic, count)
+
+    await history_writer.enqueue(user_id, "flashcards", f"{topic} ({len(cards)})")
+
+    return {"flashcards": cards}
+
+
 @app.post("/ai/flashcards")
-def ai_flashcards(
+async def ai_flashcards(
+    payload: dict = Body(...),
+    run_async: bool = Query(False, alias="async"),
+    user: Principal = Depends(admit("flashcards"))
+):
+    if run_async:
+        return await submit_job(user, "flashcards", payload)
+    return await run_flashcards(user.id, payload)
+
+
+@app.post("/ai/flashcards/stream")
+async def ai_flashcards_stream(
     payload: dict = Body(...),
-    session: Session = Depends(get_session),
-    user: User = Depends(get_current_user)
+    user: Principal = Depends(admit("flashcards"))
 ):
     topic = payload.get("topic", "")
     count = int(payload.get("count", 8))
 
-    cards = ai_utils.generate_flashcards(topic, count)
+    async def record(cards):
+        await history_writer.enqueue(user.id, "flashcards", f"{topic} ({len(cards)})")
 
-    session.add(History(user_id=user.id, feature="flashcards", details=f"{topic} ({len(cards)})"))
-    session.commit()
-
-    return {"flashcards": cards}
+    return await ndjson_response(ai_utils.stream_flashcards(topic, count), record)
 
 
 # ===============================
 # AI – STUDY PLAN
 # ===============================
+@job_queue.handler("plan")
+async def run_plan(user_id: int, payload: dict):
+    topic = payload.get("topic", "")
+
+    plan = await ai_utils.generate_plan_async(topic)
+
+    await history_writer.enqueue(user_id, "plan", topic)
+
+    return {"plan": plan}
+
+
 @app.post("/ai/plan")
-def ai_plan(
+async def ai_plan(
     payload: dict = Body(...),
-    session: Session = Depends(get_session),
-    user: User = Depends(get_current_user)
+    run_async: bool = Query(False, alias="async"),
+    user: Principal = Depends(admit("plan"))
 ):
-    topic = payload.get("topic", "")
+    if run_async:
+        return await submit_job(user, "plan", payload)
+    return await run_plan(user.id, payload)
 
-    plan = ai_utils.generate_plan(topic)
 
-    session.add(History(user_id=user.id, feature="plan", details=topic))
-    session.commit()
+@app.post("/ai/plan/stream")
+async def ai_plan_stream(
+    payload: dict = Body(...),
+    user: Principal = Depends(admit("plan"))
+):
+    topic = payload.get("topic", "")
 
-    return {"plan": plan}
+    async def record(_text):
+        await history_writer.enqueue(user.id, "plan", topic)
+
+    return await sse_response(ai_utils.stream_plan(topic), record)
 
 
 # ===============================
 # AI – QUIZ
 # ===============================
+@job_queue.handler("quiz")
+async def run_quiz(user_id: int, payload: dict):
+    topic = payload.get("topic", "")
+
+    quiz = await ai_utils.generate_quiz_async(topic)
+
+    await history_writer.enqueue(user_id, "quiz", topic)
+
+    return {"quiz": quiz}
+
+
 @app.post("/ai/quiz")
-def ai_quiz(
+async def ai_quiz(
     payload: dict = Body(...),
-    session: Session = Depends(get_session),
-    user: User = Depends(get_current_user)
+    run_async: bool = Query(False, alias="async"),
+    user: Principal = Depends(admit("quiz"))
 ):
-    topic = payload.get("topic", "")
+    if run_async:
+        return await submit_job(user, "quiz", payload)
+    return await run_quiz(user.id, payload)
 
-    quiz = ai_utils.generate_quiz(topic)
 
-    session.add(History(user_id=user.id, feature="quiz", details=topic))
-    session.commit()
+@app.post("/ai/quiz/stream")
+async def ai_quiz_stream(
+    payload: dict = Body(...),
+    user: Principal = Depends(admit("quiz"))
+):
+    topic = payload.get("topic", "")
+
+    async def record(_quiz):
+        await history_writer.enqueue(user.id, "quiz", topic)
 
-    return {"quiz": quiz}
+    return await ndjson_response(ai_utils.stream_quiz(topic), record)
 
 
 # ===============================
 # AI – MINDMAP
 # ===============================
-@app.post("/ai/mindmap")
-def ai_mindmap(
-    payload: dict = Body(...),
-    session: Session = Depends(get_session),
-    user: User = Depends(get_current_user)
-):
+@job_queue.handler("mindmap")
+async def run_mindmap(user_id: int, payload: dict):
     topic = payload.get("topic") or payload.get("title", "")
     text = payload.get("text") or payload.get("content", "")
 
     if not text:
-        text = ai_utils.generate_notes(topic or "")
+        text = await ai_utils.generate_notes_async(topic or "")
 
-    mindmap = ai_utils.generate_mindmap_from_text(topic or "Mindmap", text)
+    mindmap = await ai_utils.generate_mindmap_from_text_async(topic or "Mindmap", text)
 
-    session.add(History(user_id=user.id, feature="mindmap", details=topic))
-    session.commit()
+    await history_writer.enqueue(user_id, "mindmap", topic)
 
     return {"mindmap": mindmap}
 
 
+@app.post("/ai/mindmap")
+async def ai_mindmap(
+    payload: dict = Body(...),
+    run_async: bool = Query(False, alias="async"),
+    user: Principal = Depends(admit("mindmap"))
+):
+    if run_async:
+        return await submit_job(user, "mindmap", payload)
+    return await run_mindmap(user.id, payload)
+
+
+# ===============================
+# AI – STUDY PACK (several artifacts for one topic, streamed as they finish)
+# ===============================
+PACK_ARTIFACTS = ("notes", "flashcards", "quiz", "plan", "mindmap")
+
+
+async def _pack_items(topic: str, artifacts, count: int):
+    # Notes are generated once and shared with the mindmap
+    notes_task = None
+    if "notes" in artifacts or "mindmap" in artifacts:
+        notes_task = asyncio.ensure_future(ai_utils.generate_notes_async(topic))
+
+    async def notes():
+        return {"notes": await asyncio.shield(notes_task)}
+
+    async def flashcards():
+        return {"flashcards": await ai_utils.generate_flashcards_async(topic, count)}
+
+    async def quiz():
+        return {"quiz": await ai_utils.generate_quiz_async(topic)}
+
+    async def plan():
+        return {"plan": await ai_utils.generate_plan_async(topic)}
+
+    async def mindmap():
+        text = await asyncio.shield(notes_task)
+        return {"mindmap": await ai_utils.generate_mindmap_from_text_async(topic or "Mindmap", text)}
+
+    runners = {"notes": notes, "flashcards": flashcards, "quiz": quiz, "plan": plan, "mindmap": mindmap}
+    tasks = {asyncio.ensure_future(runners[name]()): name for name in artifacts}
+
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = tasks[task]
+                try:
+                    data = task.result()
+                except Exception as e:
+                    yield {"artifact": name, "error": str(e)}
+                    continue
+                yield {"artifact": name, **data}
+    finally:
+        # Client went away: stop whatever is still generating
+        for task in tasks:
+            task.cancel()
+        if notes_task is not None:
+            notes_task.cancel()
+
+
+@app.post("/ai/pack")
+async def ai_pack(
+    payload: dict = Body(...),
+    user: Principal = Depends(admit("pack"))
+):
+    topic = payload.get("topic", "")
+    artifacts = payload.get("artifacts") or list(PACK_ARTIFACTS)
+    count = int(payload.get("count", 8))
+
+    if not topic:
+        raise HTTPException(status_code=400, detail="Topic required")
+    if not isinstance(artifacts, list) or any(a not in PACK_ARTIFACTS for a in artifacts):
+        raise HTTPException(status_code=400, detail=f"artifacts must be a list drawn from {list(PACK_ARTIFACTS)}")
+    artifacts = list(dict.fromkeys(artifacts))
+
+    # Notes are shared with the mindmap, so it only adds its own call
+    cost = sum(FEATURE_COSTS[a] for a in artifacts)
+    if "notes" in artifacts and "mindmap" in artifacts:
+        cost -= FEATURE_COSTS["notes"]
+    await user_limiter.extend("pack", cost)
+
+    async def record(items):
+        entries = []
+        for item in items:
+            if "error" in item:
+                continue
+            if item["artifact"] == "flashcards":
+                entries.append(("flashcards", f"{topic} ({len(item['flashcards'])})"))
+            else:
+                entries.append((item["artifact"], topic))
+        await history_writer.enqueue_many(user.id, entries)
+
+    return await ndjson_response(_pack_items(topic, artifacts, count), record, prime=False)
+
+
 # ===============================
 # AI – MINDMAP (UPLOAD PDF)
 # ===============================
+# Identical uploads (same SHA-256) skip both PyPDF2 and Groq
+def _upload_mindmap_key(digest):
+    return ai_cache.make_key("pdf_mindmap", ai_utils.MODEL, digest)
+
+
+async def _upload_pages(path, digest):
+    cached = pdf_text_cache.get("pdf_text", digest)
+    if cached is not None:
+        return json.loads(cached)
+
+    async with aclosing(pdf_utils.iter_pdf_pages(path)) as source:
+        pages = [page async for page in source]
+    if any(p.strip() for p in pages):
+        pdf_text_cache.set("pdf_text", digest, json.dumps(pages))
+    return pages
+
+
+# The job carries the extracted pages, so it doesn't depend on the upload
+# or the in-memory text cache still being there when it runs
+@job_queue.handler("mindmap_upload")
+async def run_mindmap_upload(user_id: int, payload: dict):
+    title, digest = payload["title"], payload["digest"]
+    mindmap = await ai_utils.generate_mindmap_from_pages_async(title, payload["pages"])
+    await pdf_mindmap_cache.aset("pdf_mindmap", _upload_mindmap_key(digest), json.dumps(mindmap))
+    await history_writer.enqueue(user_id, "mindmap", f"upload:{title}")
+    return {"mindmap": mindmap}
+
+
 @app.post("/ai/mindmap/upload")
 async def ai_mindmap_upload(
     file: UploadFile = File(...),
-    session: Session = Depends(get_session),
-    user: User = Depends(get_current_user)
+    user: Principal = Depends(admit("mindmap_upload"))
 ):
-    data = await file.read()
-
-    text = ai_utils.extract_pdf_text(BytesIO(data))
+    try:
+        path, digest = await pdf_utils.spool_upload(file)
+    except pdf_utils.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
-    if not text:
+    try:
+        cached = await pdf_mindmap_cache.aget("pdf_mindmap", _upload_mindmap_key(digest))
+        if cached is not None:
+            await history_writer.enqueue(user.id, "mindmap", f"upload:{file.filename}")
+            return {"mindmap": json.loads(cached)}
+        pages = await _upload_pages(path, digest)
+    except pdf_utils.PDFExtractTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    finally:
+        os.unlink(path)
+
+    chunks = ai_utils.split_text_chunks(pages)
+    if not chunks:
         raise HTTPException(status_code=400, detail="PDF contains no extractable text")
 
-    mindmap = ai_utils.generate_mindmap_from_text(file.filename, text)
-
-    session.add(History(user_id=user.id, feature="mindmap", details=f"upload:{file.filename}"))
-    session.commit()
-
-    return {"mindmap": mindmap}
+    # The whole upload is admitted before any chunk is summarized, so it
+    # never runs out of budget part way; over budget it runs as a job
+    payload = {"title": file.filename, "digest": digest, "pages": pages}
+    try:
+        await user_limiter.extend("mindmap_upload", ai_utils.estimate_mindmap_tokens(file.filename, chunks))
+    except RateLimited:
+        return await submit_job(user, "mindmap_upload", payload)
+    return await run_mindmap_upload(user.id, payload)
 
 
 # ===============================
 # AI – TUTOR CHAT
 # ===============================
+# Conversations live server-side (tutor.py): send "session": true to start
+# one and pass the returned session_id to continue it; without either the
+# exchange is one-off and nothing is stored. Each call sends the rolling
+# summary plus recent turns within TUTOR_PROMPT_TOKENS; older turns are
+# summarized after the reply is sent.
+async def _tutor_context(user_id: int, payload: dict):
+    ctx = await tutor_sessions.open(
+        user_id, payload.get("session_id"), payload.get("message", ""), create=payload.get("session") is True
+    )
+    if ctx is None:
+        raise HTTPException(status_code=404, detail="Tutor session not found")
+    return ctx
+
+
+@job_queue.handler("tutor")
+async def run_tutor(user_id: int, payload: dict, background: BackgroundTasks = None):
+    msg = payload.get("message", "")
+    ctx = await _tutor_context(user_id, payload)
+
+    reply = await ai_utils.chat_with_tutor_async(ctx.message, ctx.summary, ctx.turns)
+
+    if await tutor_sessions.record(ctx, msg, reply):
+        if background is not None:
+            background.add_task(tutor_sessions.compact, ctx.session_id)
+        else:
+            tutor_sessions.compact_soon(ctx.session_id)
+    await history_writer.enqueue(user_id, "tutor", msg[:200])
+
+    return {"reply": reply, "session_id": ctx.session_id}
+
+
 @app.post("/ai/tutor")
-def ai_tutor(
+async def ai_tutor(
+    background_tasks: BackgroundTasks,
     payload: dict = Body(...),
-    session: Session = Depends(get_session),
-    user: User = Depends(get_current_user)
+    run_async: bool = Query(False, alias="async"),
+    user: Principal = Depends(admit("tutor"))
 ):
-    msg = payload.get("message", "")
-
-    reply = ai_utils.chat_with_tutor(msg)
+    if run_async:
+        session_id = payload.get("session_id")
+        if session_id and not await tutor_sessions.exists(session_id, user.id):
+            raise HTTPException(status_code=404, detail="Tutor session not found")
+        return await submit_job(user, "tutor", payload)
+    return await run_tutor(user.id, payload, background_tasks)
 
-    session.add(History(user_id=user.id, feature="tutor", details=msg[:200]))
-    session.commit()
 
-    return {"reply": reply}
+@app.post("/ai/tutor/stream")
+async def ai_tutor_stream(
+    background_tasks: BackgroundTasks,
+    payload: dict = Body(...),
+    user: Principal = Depends(admit("tutor"))
+):
+    msg = payload.get("message", "")
+    ctx = await _tutor_context(user.id, payload)
+
+    async def record(text):
+        if await tutor_sessions.record(ctx, msg, text):
+            background_tasks.add_task(tutor_sessions.compact, ctx.session_id)
+        await history_writer.enqueue(user.id, "tutor", msg[:200])
+
+    # FastAPI attaches background_tasks to the streaming response, so
+    # compaction runs once the last event has been sent
+    response = await sse_response(ai_utils.stream_tutor(ctx.message, ctx.summary, ctx.turns), record)
+    if ctx.session_id:
+        response.headers["X-Tutor-Session"] = ctx.session_id
+    return response
+
+
+@app.get("/ai/tutor/sessions/{session_id}")
+async def tutor_session(session_id: str, user: Principal = Depends(get_current_user)):
+    transcript = await asyncio.to_thread(tutor_sessions.transcript, session_id, user.id)
+    if transcript is None:
+        raise HTTPException(status_code=404, detail="Tutor session not found")
+    return transcript
+
+
+@app.delete("/ai/tutor/sessions/{session_id}")
+async def delete_tutor_session(session_id: str, user: Principal = Depends(get_current_user)):
+    if not await asyncio.to_thread(tutor_sessions.delete, session_id, user.id):
+        raise HTTPException(status_code=404, detail="Tutor session not found")
+    return {"deleted": True}
@@ -0,0 +1,256 @@
+# backend/metrics.py
+# Minimal Prometheus-format metrics with no dependencies. Recording is a
+# dict lookup plus a bisect and two adds; there is no lock, so concurrent
+# threads can very rarely drop an increment - accepted to keep the hot
+# path in the low hundreds of nanoseconds.
+import time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+_registry = []
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _fmt_value(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self):
+        lines = self._header()
+        for values, child in self._children.items():
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {_fmt_value(child.value)}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def observe_since(self, started):
+        value = time.perf_counter() - started
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.bounds = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = self._header()
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, values, ('le', le))} {cumulative}")
+            labels = _fmt_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_fmt_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    # Sampled at scrape time: `collect` returns {label values tuple: value}
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), collect=None):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = self._header()
+        try:
+            samples = self.collect() if self.collect else {}
+        except Exception:
+            samples = {}
+        for values, value in samples.items():
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {_fmt_value(value)}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============================================================
+# METRICS
+# ============================================================
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+
+llm_ttft_seconds = Histogram(
+    "llm_time_to_first_token_seconds", "Time to first streamed token",
+    ("feature",),
+)
+llm_total_seconds = Histogram(
+    "llm_request_duration_seconds", "LLM call latency including retries",
+    ("feature",),
+)
+llm_prompt_tokens = Counter("llm_prompt_tokens_total", "Prompt tokens reported by the provider", ("feature",))
+llm_completion_tokens = Counter("llm_completion_tokens_total", "Completion tokens reported by the provider", ("feature",))
+llm_errors = Counter("llm_errors_total", "LLM calls that failed after retries", ("feature", "error"))
+
+db_checkout_seconds = Histogram(
+    "db_pool_checkout_seconds", "Time spent waiting for a pooled DB connection", buckets=DB_BUCKETS,
+)
+db_query_seconds = Histogram(
+    "db_query_duration_seconds", "DB statement execution time", ("statement",), buckets=DB_BUCKETS,
+)
+
+pdf_seconds = Histogram("pdf_duration_seconds", "PDF text extraction and rendering time", ("op",))
+
+
+def record_llm_usage(feature: str, usage):
+    if usage is None:
+        return
+    prompt_tokens, completion_tokens = usage
+    if prompt_tokens:
+        llm_prompt_tokens.labels(feature).inc(prompt_tokens)
+    if completion_tokens:
+        llm_completion_tokens.labels(feature).inc(completion_tokens)
+
+
+# ============================================================
+# SQLALCHEMY HOOKS
+# ============================================================
+_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is not None:
+            verb = statement.lstrip()[:6].upper()
+            db_query_seconds.labels(verb if verb in _STATEMENTS else "OTHER").observe_since(started)
+
+    # The pool has no "before checkout" event, so time Pool.connect itself
+    # (what Engine.connect/Session call to check a connection out).
+    pool = engine.pool
+    connect = pool.connect
+    checkout = db_checkout_seconds.labels()
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            checkout.observe_since(started)
+
+    pool.connect = timed_connect
+
+
+# ============================================================
+# ASGI MIDDLEWARE (labels by route template, not raw path)
+# ============================================================
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route_path(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None:
+            app = scope["app"]
+            self._routes = {getattr(r, "endpoint", None): r.path for r in app.routes}
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_seconds.labels(scope["method"], self._route_path(scope), status).observe_since(started)
@@ -1,10 +1,11 @@
 # backend/models.py
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship
 from pydantic import BaseModel
 
-Base = declarative_base()
+# Share the declarative base with db.py so create_db() actually creates these tables
+from db import Base
 
 # ============================
 # User Table
@@ -35,6 +36,25 @@ class History(Base):
 
     user = relationship("User", back_populates="history")
 
+    __table_args__ = (
+        # Covers per-user GROUP BY feature counts and recent-activity lookups
+        Index("ix_history_user_feature_created", "user_id", "feature", "created_at"),
+        # Keyset pagination / export order: (created_at, id) per user
+        Index("ix_history_user_created_id", "user_id", "created_at", "id"),
+    )
+
+
+# ============================
+# Per-user Feature Counters (maintained with every History insert)
+# ============================
+class UserFeatureStat(Base):
+    __tablename__ = "user_feature_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    feature = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 
 # ============================
 # Refresh Token Table
@@ -44,9 +64,93 @@ class RefreshToken(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    token = Column(String, nullable=False)
+    # SHA-256 hex of the issued token (db.create_db converts legacy plaintext rows)
+    token_hash = Column(String(64), nullable=False, unique=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=True, index=True)
+
+
+# ============================
+# AI Response Cache Table (persistent tier of ai_cache)
+# ============================
+class AICacheEntry(Base):
+    __tablename__ = "ai_cache"
+
+    key = Column(String(64), primary_key=True)
+    feature = Column(String, nullable=False)
+    value = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=True, index=True)
+
+
+# ============================
+# Background Generation Jobs (see jobs.py)
+# ============================
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String, nullable=False)          # notes, plan, quiz, flashcards, mindmap, tutor
+    status = Column(String, nullable=False, default="queued")   # queued, running, done, failed
+    payload = Column(Text, nullable=False)          # JSON request body
+    result = Column(Text, nullable=True)            # JSON response body once done
+    error = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    expires_at = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Restart recovery scans queued/running jobs in submission order
+        Index("ix_jobs_status_created", "status", "created_at"),
+        # Per-user listing and retention sweeps
+        Index("ix_jobs_user_created", "user_id", "created_at"),
+    )
+
+
+# ============================
+# Shared rate-limit buckets (RATE_LIMIT_BACKEND=db, see ratelimit.py)
+# ============================
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)        # e.g. "user:42"
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)    # epoch seconds, so refill is plain arithmetic in SQL
+
+
+# ============================
+# Tutor Conversations (see tutor.py)
+# ============================
+class TutorSession(Base):
+    __tablename__ = "tutor_sessions"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    summary = Column(Text, nullable=False, default="")    # rolling summary of turns up to summarized_through
+    summarized_through = Column(Integer, nullable=False, default=0)   # last TutorTurn.id folded into summary
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_tutor_sessions_user_updated", "user_id", "updated_at"),
+        Index("ix_tutor_sessions_updated", "updated_at"),   # idle sweep
+    )
+
+
+class TutorTurn(Base):
+    __tablename__ = "tutor_turns"
+
+    id = Column(Integer, primary_key=True)             # also the turn order within a session
+    session_id = Column(String(32), ForeignKey("tutor_sessions.id", ondelete="CASCADE"), nullable=False)
+    role = Column(String, nullable=False)              # user, tutor
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Recent-window and unsummarized-turn reads walk one session by id
+        Index("ix_tutor_turns_session_id", "session_id", "id"),
+    )
 
 
 # ============================
@@ -0,0 +1,210 @@
+# backend/pdf_utils.py
+# Kept free of app imports: process-pool workers import this module.
+import os
+import time
+import asyncio
+import hashlib
+from io import BytesIO
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics   # dependency-free, safe to import in workers
+
+# ============================================================
+# CONFIG
+# ============================================================
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+PDF_EXTRACT_TIMEOUT = float(os.getenv("PDF_EXTRACT_TIMEOUT", "120"))
+PDF_POOL_WARMUP = os.getenv("PDF_POOL_WARMUP", "1") == "1"
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class PDFExtractTimeout(Exception):
+    pass
+
+
+# ============================================================
+# UPLOAD SPOOLING (chunked, size-capped, never fully in memory)
+# Returns (temp path, SHA-256 hex of the uploaded bytes)
+# ============================================================
+async def spool_upload(upload, max_bytes: int = UPLOAD_MAX_BYTES):
+    size = 0
+    digest = hashlib.sha256()
+    out = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", delete=False)
+    try:
+        with out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(out.name)
+        raise
+    return out.name, digest.hexdigest()
+
+
+# ============================================================
+# PROCESS-POOL EXTRACTION (page ranges spread across workers)
+# ============================================================
+def _count_pages(path: str) -> int:
+    import PyPDF2
+
+    try:
+        return len(PyPDF2.PdfReader(path).pages)
+    except Exception:
+        return 0
+
+
+def _extract_range(path: str, start: int, stop: int):
+    import PyPDF2
+
+    try:
+        reader = PyPDF2.PdfReader(path)
+    except Exception:
+        return [""] * (stop - start)
+    pages = []
+    for i in range(start, stop):
+        try:
+            pages.append(reader.pages[i].extract_text() or "")
+        except Exception:
+            pages.append("")
+    return pages
+
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _import_libs():
+    import PyPDF2  # noqa: F401
+    from reportlab.pdfgen import canvas  # noqa: F401
+
+
+# Spawn the workers and import PyPDF2/reportlab in them ahead of the
+# first upload, so that request doesn't pay ~1 s of process start-up
+async def warmup():
+    if not PDF_POOL_WARMUP:
+        return
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, _import_libs) for _ in range(PDF_WORKERS)))
+
+
+# Yields page texts in order as soon as their range is extracted, so
+# downstream stages can start before the whole document is parsed.
+async def iter_pdf_pages(path: str, timeout: float = PDF_EXTRACT_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    started = time.perf_counter()
+    pool = _get_pool()
+
+    try:
+        count = await asyncio.wait_for(loop.run_in_executor(pool, _count_pages, path), timeout)
+    except asyncio.TimeoutError:
+        raise PDFExtractTimeout("PDF page count timed out")
+    except BrokenProcessPool:
+        shutdown_pool()   # a crashed worker poisons the pool; rebuild on next use
+        raise
+
+    futures = [
+        loop.run_in_executor(pool, _extract_range, path, start, min(start + PDF_PAGES_PER_TASK, count))
+        for start in range(0, count, PDF_PAGES_PER_TASK)
+    ]
+    try:
+        for fut in futures:
+            try:
+                pages = await asyncio.wait_for(fut, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                raise PDFExtractTimeout(f"PDF extraction exceeded {timeout:.0f}s")
+            except BrokenProcessPool:
+                shutdown_pool()
+                raise
+            for page in pages:
+                yield page
+        metrics.pdf_seconds.labels("extract").observe_since(started)
+    finally:
+        # Ranges not yet started are dropped; running ones finish in the worker
+        for fut in futures:
+            fut.cancel()
+
+
+# ============================================================
+# NOTES -> PDF RENDERING (runs in the same process pool)
+# ============================================================
+def notes_cache_key(title: str, notes: str) -> str:
+    return hashlib.sha256(f"{title}\0{notes}".encode("utf-8")).hexdigest()
+
+
+def render_notes_pdf(title: str, text: str) -> bytes:
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    buf = BytesIO()
+    pdf = canvas.Canvas(buf, pagesize=letter)
+
+    pdf.setTitle(title)
+    width, height = letter
+    y = height - 40
+
+    pdf.setFont("Helvetica-Bold", 18)
+    pdf.drawString(40, y, title)
+    y -= 30
+
+    pdf.setFont("Helvetica", 11)
+    for line in text.splitlines():
+        if y < 40:
+            pdf.showPage()
+            pdf.setFont("Helvetica", 11)
+            y = height - 40
+
+        while len(line) > 95:
+            pdf.drawString(40, y, line[:95])
+            line = line[95:]
+            y -= 14
+
+        pdf.drawString(40, y, line)
+        y -= 14
+
+    pdf.save()
+    return buf.getvalue()
+
+
+async def render_notes_pdf_async(title: str, text: str) -> bytes:
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        pdf_bytes = await loop.run_in_executor(_get_pool(), render_notes_pdf, title, text)
+    except BrokenProcessPool:
+        shutdown_pool()
+        raise
+    metrics.pdf_seconds.labels("render").observe_since(started)
+    return pdf_bytes
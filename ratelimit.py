@@ -0,0 +1,389 @@
+# backend/ratelimit.py
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextlib
+import contextvars
+
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from db import SessionLocal
+from models import RateLimitBucket
+
+# Per-user token budget, in LLM tokens (the same unit Groq bills)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")   # memory | db (shared across workers)
+RATE_LIMIT_TOKENS_PER_MINUTE = float(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", "12000"))
+RATE_LIMIT_BURST_TOKENS = float(os.getenv("RATE_LIMIT_BURST_TOKENS", "20000"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "50000"))
+
+# Global cap on concurrent upstream calls; waits longer than the deadline are shed
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "32"))
+ADMISSION_DEADLINE_SECONDS = float(os.getenv("ADMISSION_DEADLINE_SECONDS", "10"))
+
+# Expected total tokens (prompt + completion) per request. It is reserved
+# up front and settled against what the request's upstream calls billed,
+# so cache and single-flight hits are refunded in full.
+FEATURE_COSTS = {
+    "notes": 3000,
+    "plan": 1500,
+    "quiz": 1500,
+    "flashcards": 1000,
+    "mindmap": 4000,          # notes + mindmap when no text is supplied
+    "mindmap_upload": 1,      # admission only; sized from the chunk count after extraction
+    "pack": 0,                # sized from the requested artifacts
+    "tutor": 300,
+}
+
+# Lower runs first when upstream calls queue for a slot
+PRIORITIES = {
+    "tutor": 0,
+    "answer": 0,
+    "quiz": 1,
+    "flashcards": 1,
+    "plan": 2,
+    "notes": 2,
+    "mindmap": 3,
+    "mindmap_chunk": 4,
+    "tutor_summary": 4,       # background, after the reply is sent
+}
+
+admission_rejected = metrics.Counter(
+    "admission_rejected_total", "Requests shed with 429", ("reason", "feature"),
+)
+
+
+# The reservation of the request (or job) being served; upstream calls
+# record their usage against it. Tasks spawned by the request inherit it.
+_reservation = contextvars.ContextVar("reservation", default=None)
+
+
+class RateLimited(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Reservation:
+    def __init__(self, user_id: int, feature: str, taken: float = 0.0):
+        self.user_id = user_id
+        self.feature = feature
+        self.taken = taken       # debited from the bucket so far
+        self.used = 0.0          # billed by upstream calls
+        self.settled = False
+
+
+# ============================================================
+# TOKEN-BUCKET STORES
+# take(key, cost) -> 0.0 when admitted, else seconds until `cost` is available
+# ============================================================
+class MemoryBucketStore:
+    name = "memory"
+
+    def __init__(self, rate_per_sec: float, capacity: float, max_keys: int):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = {}   # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def take(self, key, cost: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._evict_full(now)
+                bucket = self._buckets[key] = [self.capacity, now]
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return 0.0
+            bucket[0] = tokens
+            return (cost - tokens) / self.rate
+
+    async def atake(self, key, cost: float) -> float:
+        return self.take(key, cost)
+
+    # Credit (refund) or debit tokens without an admission check
+    def give(self, key, tokens: float):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if tokens >= 0:
+                    return   # evicted buckets were full
+                bucket = self._buckets[key] = [self.capacity, now]
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate + tokens)
+            bucket[1] = now
+
+    async def agive(self, key, tokens: float):
+        self.give(key, tokens)
+
+    def _evict_full(self, now):
+        # A bucket that has refilled to capacity is the same as no bucket
+        full = [k for k, (t, u) in self._buckets.items() if t + (now - u) * self.rate >= self.capacity]
+        for k in full:
+            del self._buckets[k]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class DBBucketStore:
+    # One conditional UPDATE refills and debits atomically, so several
+    # worker processes can share a bucket without a lock service.
+    name = "db"
+
+    def __init__(self, session_factory, rate_per_sec: float, capacity: float):
+        self.session_factory = session_factory
+        self.rate = rate_per_sec
+        self.capacity = capacity
+
+    def _refilled(self, now):
+        t = RateLimitBucket.tokens + (now - RateLimitBucket.updated_at) * self.rate
+        return case((t > self.capacity, self.capacity), else_=t)
+
+    def take(self, key, cost: float) -> float:
+        now = time.time()
+        with self.session_factory() as session:
+            refilled = self._refilled(now)
+            debited = session.execute(
+                update(RateLimitBucket)
+                .where(RateLimitBucket.key == key, refilled >= cost)
+                .values(tokens=refilled - cost, updated_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if debited:
+                session.commit()
+                return 0.0
+
+            tokens = session.execute(select(refilled).where(RateLimitBucket.key == key)).scalar()
+            if tokens is None:
+                try:
+                    session.execute(insert(RateLimitBucket), [{
+                        "key": key, "tokens": max(self.capacity - cost, 0.0), "updated_at": now,
+                    }])
+                    session.commit()
+                    return 0.0 if cost <= self.capacity else (cost - self.capacity) / self.rate
+                except IntegrityError:
+                    session.rollback()   # another worker created it first
+                    return self.take(key, cost)
+            session.rollback()
+            return (cost - tokens) / self.rate
+
+    async def atake(self, key, cost: float) -> float:
+        return await asyncio.to_thread(self.take, key, cost)
+
+    def give(self, key, tokens: float):
+        now = time.time()
+        refilled = self._refilled(now) + tokens
+        with self.session_factory() as session:
+            session.execute(
+                update(RateLimitBucket)
+                .where(RateLimitBucket.key == key)
+                .values(tokens=case((refilled > self.capacity, self.capacity), else_=refilled), updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+    async def agive(self, key, tokens: float):
+        await asyncio.to_thread(self.give, key, tokens)
+
+
+# ============================================================
+# PER-USER ADMISSION (token budget weighted by feature cost)
+# ============================================================
+class UserRateLimiter:
+    def __init__(self, store, enabled: bool, max_wait: float):
+        self.store = store
+        self.enabled = enabled
+        self.max_wait = max_wait
+        self.admitted = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.refunded = 0.0
+
+    async def admit(self, user_id: int, feature: str, cost: float = None):
+        if not self.enabled:
+            return
+        cost = cost if cost is not None else FEATURE_COSTS.get(feature, 1000)
+        key = f"user:{user_id}"
+        wait = await self.store.atake(key, cost)
+
+        if 0 < wait <= self.max_wait:
+            # Close enough: wait for the refill rather than bounce the client
+            self.delayed += 1
+            await asyncio.sleep(wait)
+            wait = await self.store.atake(key, cost)
+
+        if wait > 0:
+            self.rejected += 1
+            admission_rejected.labels("user_budget", feature).inc()
+            raise RateLimited("Rate limit exceeded for this account", retry_after=wait)
+        self.admitted += 1
+
+    # ---------- reservations ----------
+    # reserve() admits the expected cost and makes the reservation current;
+    # record() adds each upstream call's billed tokens to it; settle() gives
+    # back what was not used, or debits the overrun.
+    async def reserve(self, user_id: int, feature: str, cost: float = None) -> Reservation:
+        cost = cost if cost is not None else FEATURE_COSTS.get(feature, 1000)
+        await self.admit(user_id, feature, cost)
+        reservation = Reservation(user_id, feature, cost if self.enabled else 0.0)
+        _reservation.set(reservation)
+        return reservation
+
+    # For requests whose cost is only known part way (a PDF's chunk count, a
+    # pack's artifacts). A bucket never holds more than its capacity, so a
+    # larger cost is admitted once the bucket is full and the rest is debited
+    # when the reservation settles.
+    async def extend(self, feature: str, cost: float):
+        reservation = _reservation.get()
+        if reservation is None or not self.enabled:
+            return
+        cost = min(cost, self.store.capacity)
+        await self.admit(reservation.user_id, feature, cost)
+        reservation.taken += cost
+
+    async def record(self, tokens: float):
+        reservation = _reservation.get()
+        if reservation is None or not self.enabled:
+            return
+        if reservation.settled:
+            # Outlived its request (a single-flight leader that lost its client)
+            await self.store.agive(f"user:{reservation.user_id}", -tokens)
+        else:
+            reservation.used += tokens
+
+    async def settle(self, reservation: Reservation):
+        if reservation.settled:
+            return
+        reservation.settled = True
+        delta = reservation.taken - reservation.used
+        if delta:
+            if delta > 0:
+                self.refunded += delta
+            await self.store.agive(f"user:{reservation.user_id}", delta)
+
+    # Jobs and other work outside a request: usage is debited on exit
+    @contextlib.asynccontextmanager
+    async def metered(self, user_id: int, feature: str):
+        reservation = Reservation(user_id, feature)
+        token = _reservation.set(reservation)
+        try:
+            yield reservation
+        finally:
+            _reservation.reset(token)
+            await self.settle(reservation)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "backend": self.store.name,
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "rejected": self.rejected,
+            "refunded_tokens": round(self.refunded),
+        }
+
+
+# ============================================================
+# GLOBAL UPSTREAM CONCURRENCY (priority queue with deadline shedding)
+# ============================================================
+class PriorityLimiter:
+    def __init__(self, capacity: int, deadline: float):
+        self.capacity = capacity
+        self.deadline = deadline
+        self.in_use = 0
+        self._waiters = []                 # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._avg_hold = 1.0               # EWMA of slot hold time, seconds
+        self.acquired = 0
+        self.shed = 0
+
+    def _estimated_wait(self, priority):
+        ahead = sum(1 for p, _, f in self._waiters if p <= priority and not f.done())
+        return (ahead + 1) * self._avg_hold / self.capacity
+
+    def _prune(self):
+        # Drop waiters that timed out or were cancelled from the head
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+    async def acquire(self, label: str):
+        priority = PRIORITIES.get(label, 2)
+        self._prune()
+        if self.in_use < self.capacity and not self._waiters:
+            self.in_use += 1
+            self.acquired += 1
+            return
+
+        estimate = self._estimated_wait(priority)
+        if estimate > self.deadline:
+            self._shed(label, estimate)
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.deadline)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                self._release_slot()   # granted just as we timed out
+            fut.cancel()
+            self._shed(label, self._avg_hold)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release_slot()
+            fut.cancel()
+            raise
+        self.acquired += 1
+
+    def _shed(self, label, retry_after):
+        self.shed += 1
+        admission_rejected.labels("upstream_busy", label).inc()
+        raise RateLimited("AI service is busy, please retry", retry_after=retry_after)
+
+    def release(self, held_seconds: float):
+        self._avg_hold = 0.9 * self._avg_hold + 0.1 * held_seconds
+        self._release_slot()
+
+    def _release_slot(self):
+        # Hand the slot straight to the best live waiter, if any
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.in_use -= 1
+
+    def waiting(self):
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "waiting": self.waiting(),
+            "avg_hold_ms": round(self._avg_hold * 1000, 1),
+            "acquired": self.acquired,
+            "shed": self.shed,
+        }
+
+
+def _make_store():
+    rate = RATE_LIMIT_TOKENS_PER_MINUTE / 60
+    if RATE_LIMIT_BACKEND == "db":
+        return DBBucketStore(SessionLocal, rate, RATE_LIMIT_BURST_TOKENS)
+    return MemoryBucketStore(rate, RATE_LIMIT_BURST_TOKENS, RATE_LIMIT_MAX_KEYS)
+
+
+user_limiter = UserRateLimiter(_make_store(), enabled=RATE_LIMIT_ENABLED, max_wait=ADMISSION_DEADLINE_SECONDS)
+upstream_limiter = PriorityLimiter(UPSTREAM_CONCURRENCY, ADMISSION_DEADLINE_SECONDS)
@@ -1,5 +1,6 @@
 # backend/routes_auth.py
 
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from datetime import datetime
@@ -7,69 +8,98 @@ from datetime import datetime
 from models import User, LoginData
 from db import get_session
 from auth import (
-    verify_password,
+    verify_and_update_password_async,
     create_access_token,
     create_refresh_token,
-    hash_password
+    hash_password_async,
+    PasswordHasherBusy,
 )
 
 router = APIRouter(prefix="/auth")
 
 
+def _busy():
+    return HTTPException(
+        status_code=503,
+        detail="Authentication is busy, please retry",
+        headers={"Retry-After": "1"},
+    )
+
+
+# Handlers are async so bcrypt can run in the hashing pool; the DB work
+# below is sync and goes through asyncio.to_thread to keep the loop free.
+def _find_user(session: Session, email: str):
+    return session.query(User).filter(User.email == email).first()
+
+
+def _issue_tokens(session: Session, user: User, new_hash):
+    # Read before any commit expires the instance
+    user_id, email = user.id, user.email
+
+    # Transparent rehash when BCRYPT_ROUNDS changed since this hash was made
+    if new_hash:
+        user.password = new_hash
+        session.commit()
+
+    return {
+        "access_token": create_access_token({"email": email}),
+        "refresh_token": create_refresh_token({"email": email}, session, user_id),
+        "email": email,
+    }
+
+
+def _create_user(session: Session, email: str, hashed_password: str):
+    new_user = User(
+        email=email,
+        password=hashed_password,
+        created_at=datetime.utcnow()
+    )
+
+    session.add(new_user)
+    session.commit()
+    return email
+
+
 # ---------------------- LOGIN ----------------------
 @router.post("/login")
-def login(data: LoginData, session: Session = Depends(get_session)):
-
-    print("=== LOGIN DEBUG ===")
-    print("Email:", data.email)
-    print("Password:", data.password)
+async def login(data: LoginData, session: Session = Depends(get_session)):
 
     # Find user
-    user = session.query(User).filter(User.email == data.email).first()
-    print("User exists:", bool(user))
+    user = await asyncio.to_thread(_find_user, session, data.email)
 
     if not user:
         raise HTTPException(status_code=400, detail="Invalid email")
 
-    # Check password
-    if not verify_password(data.password, user.password):
-        raise HTTPException(status_code=400, detail="Incorrect password")
+    # Check password (bcrypt runs in the dedicated hashing pool)
+    try:
+        ok, new_hash = await verify_and_update_password_async(data.password, user.password)
+    except PasswordHasherBusy:
+        raise _busy()
 
-    print("Password match: True")
+    if not ok:
+        raise HTTPException(status_code=400, detail="Incorrect password")
 
     # Create tokens
-    access_token = create_access_token({"email": user.email})
-    refresh_token = create_refresh_token({"email": user.email})
-
-    return {
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-        "email": user.email,
-    }
+    return await asyncio.to_thread(_issue_tokens, session, user, new_hash)
 
 
 # ---------------------- REGISTER ----------------------
 @router.post("/register")
-def register(data: LoginData, session: Session = Depends(get_session)):
+async def register(data: LoginData, session: Session = Depends(get_session)):
 
     # Check duplicate email
-    existing = session.query(User).filter(User.email == data.email).first()
+    existing = await asyncio.to_thread(_find_user, session, data.email)
 
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
 
     # Hash password
-    hashed_password = hash_password(data.password)
+    try:
+        hashed_password = await hash_password_async(data.password)
+    except PasswordHasherBusy:
+        raise _busy()
 
     # Create user
-    new_user = User(
-        email=data.email,
-        password=hashed_password,
-        created_at=datetime.utcnow()
-    )
-
-    session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    email = await asyncio.to_thread(_create_user, session, data.email, hashed_password)
 
-    return {"message": "User registered successfully", "email": new_user.email}
+    return {"message": "User registered successfully", "email": email}
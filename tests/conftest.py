@@ -0,0 +1,36 @@
+# backend/tests/conftest.py
+import os
+import sys
+import uuid
+import tempfile
+
+import pytest
+
+# The backend is a flat set of modules run from its own directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules read their settings at import time: a scratch database, cheap
+# bcrypt and an upstream that refuses connections unless a test fakes it
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='studyai-test-'), 'test.db')}")
+os.environ.setdefault("STARTUP_WARMUP", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("AI_BACKEND", "openai")
+os.environ.setdefault("AI_BASE_URL", "http://127.0.0.1:9/v1")
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def headers(client):
+    # A fresh account per test, so budgets and history start empty
+    email = f"{uuid.uuid4().hex[:12]}@example.com"
+    client.post("/auth/register", json={"email": email, "password": "pw123456"})
+    token = client.post("/auth/login", json={"email": email, "password": "pw123456"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
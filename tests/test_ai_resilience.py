@@ -0,0 +1,68 @@
+# backend/tests/test_ai_resilience.py
+import asyncio
+
+import pytest
+
+from ai_resilience import AICircuitOpen, CircuitBreaker, ExecutionPolicy
+
+
+def make_policy(breaker):
+    return ExecutionPolicy(
+        breaker, attempts=1, base_ms=1, max_ms=1, retry_after_max=1, hedge=False,
+        hedge_percentile=95, hedge_min_ms=1, hedge_min_samples=1, latency_window=10,
+    )
+
+
+def tripped_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    breaker = tripped_breaker()
+    policy = make_policy(breaker)
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    async def ok():
+        return "ok"
+
+    async def run():
+        probe = asyncio.create_task(policy.acall(hang))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        return await policy.acall(ok)
+
+    assert asyncio.run(run()) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_timed_out_probe_lets_the_next_call_probe():
+    breaker = tripped_breaker()
+    policy = make_policy(breaker)
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(policy.acall(hang), 0.01)
+        return await policy.acall(lambda: asyncio.sleep(0, "ok"))
+
+    assert asyncio.run(run()) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_half_open_admits_one_probe_at_a_time():
+    breaker = tripped_breaker()
+    assert breaker.allow() is True
+    with pytest.raises(AICircuitOpen):
+        breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow() is True
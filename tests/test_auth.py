@@ -0,0 +1,48 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import auth
+
+
+@pytest.fixture
+def one_slot_pool(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(auth, "PASSWORD_POOL_WORKERS", 1)
+    monkeypatch.setattr(auth, "PASSWORD_POOL_QUEUE", 0)
+    monkeypatch.setattr(auth, "_hash_executor", executor)
+    yield
+    executor.shutdown(wait=True)
+
+
+def test_cancelled_hash_keeps_its_slot_until_the_pool_finishes(one_slot_pool):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_hash():
+        started.set()
+        release.wait(5)
+        return "hashed"
+
+    async def scenario():
+        task = asyncio.create_task(auth._run_in_hash_pool(slow_hash))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()   # the client went away mid-hash
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # bcrypt is still running, so the pool is still full
+        assert auth.hash_pool_snapshot()["pending"] == 1
+        with pytest.raises(auth.PasswordHasherBusy):
+            await auth._run_in_hash_pool(lambda: "next")
+
+        release.set()
+        for _ in range(100):
+            if auth.hash_pool_snapshot()["pending"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert await auth._run_in_hash_pool(lambda: "next") == "next"
+
+    asyncio.run(scenario())
+    assert auth.hash_pool_snapshot()["pending"] == 0
@@ -0,0 +1,34 @@
+import hashlib
+
+from sqlalchemy import create_engine, inspect
+
+import db
+import models
+
+
+def test_legacy_plaintext_refresh_tokens_are_hashed(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}", future=True)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE refresh_tokens (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+            "token VARCHAR NOT NULL, created_at DATETIME, expires_at DATETIME)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO refresh_tokens VALUES "
+            "(1, 1, 'tok-a', NULL, '2026-01-08 00:00:00.000000'), "
+            "(2, 1, 'tok-a', NULL, '2026-12-09 00:00:00.000000'), "
+            "(3, 2, 'tok-b', NULL, NULL)"
+        )
+
+    table = models.RefreshToken.__table__
+    with engine.begin() as conn:
+        db._migrate_refresh_tokens(conn, table)
+    with engine.begin() as conn:
+        db._migrate_refresh_tokens(conn, table)  # already migrated: no-op
+        rows = conn.execute(table.select().order_by(table.c.id)).fetchall()
+        indexes = {i["name"]: i["unique"] for i in inspect(conn).get_indexes("refresh_tokens")}
+
+    sha = lambda t: hashlib.sha256(t.encode()).hexdigest()
+    # The duplicate keeps the row that expires last
+    assert [(r.id, r.token_hash) for r in rows] == [(2, sha("tok-a")), (3, sha("tok-b"))]
+    assert indexes["ix_refresh_tokens_token_hash"]
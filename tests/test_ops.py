@@ -0,0 +1,22 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("path", ["/ops/stats", "/metrics"])
+def test_ops_routes_are_off_without_a_token(client, path, monkeypatch):
+    monkeypatch.setattr(main, "OPS_TOKEN", "")
+
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={"Authorization": "Bearer "}).status_code == 404
+
+
+@pytest.mark.parametrize("path", ["/ops/stats", "/metrics"])
+def test_ops_routes_need_the_ops_token(client, headers, path, monkeypatch):
+    monkeypatch.setattr(main, "OPS_TOKEN", "ops-secret")
+
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 401
+    # A user's access token is not an ops token
+    assert client.get(path, headers=headers).status_code == 401
+    assert client.get(path, headers={"Authorization": "Bearer ops-secret"}).status_code == 200
@@ -0,0 +1,112 @@
+import asyncio
+
+import ai_utils
+from ai_backends import Completion, LLMBackend
+from ratelimit import MemoryBucketStore, UserRateLimiter
+
+
+class FakeBackend(LLMBackend):
+    def __init__(self, usage=(50, 100)):
+        self.usage = usage
+        self.calls = 0
+
+    async def acomplete(self, prompt, model, max_tokens, temperature):
+        self.calls += 1
+        return Completion("# Notes\n- point", self.usage)
+
+
+def limiter(capacity=10000):
+    return UserRateLimiter(MemoryBucketStore(1e-6, capacity, 100), enabled=True, max_wait=0)
+
+
+def test_settle_refunds_what_was_not_used():
+    users = limiter()
+
+    async def request():
+        reservation = await users.reserve(1, "notes", 3000)
+        await users.record(150)
+        await users.settle(reservation)
+
+    asyncio.run(request())
+    assert users.store.take("user:1", 9850) == 0.0
+    assert users.store.take("user:1", 1) > 0
+
+
+def test_overrun_is_debited_on_settle():
+    users = limiter()
+
+    async def request():
+        reservation = await users.reserve(1, "notes", 1000)
+        await users.record(4000)
+        await users.settle(reservation)
+
+    asyncio.run(request())
+    assert users.store.take("user:1", 6000) == 0.0
+    assert users.store.take("user:1", 1) > 0
+
+
+def test_cache_hits_do_not_use_up_the_budget(client, headers, monkeypatch):
+    fake = FakeBackend()
+    monkeypatch.setattr(ai_utils, "backend", fake)
+
+    # Each request reserves 3000 of a 20000 burst: without refunds the
+    # seventh would be rejected
+    codes = [client.post("/ai/notes", json={"topic": "Osmosis budget"}, headers=headers).status_code
+             for _ in range(20)]
+
+    assert codes == [200] * 20
+    assert fake.calls == 1
+
+
+# ---------- PDF uploads ----------
+def upload_pdf(lines):
+    import pdf_utils
+
+    text = "\n".join(f"Line {i} about osmosis, membranes and water potential across cells." for i in range(lines))
+    return pdf_utils.render_notes_pdf("Osmosis", text)
+
+
+class MindmapBackend(FakeBackend):
+    async def acomplete(self, prompt, model, max_tokens, temperature):
+        self.calls += 1
+        return Completion('{"title": "Osmosis", "children": [{"title": "Membranes", "children": []}]}', self.usage)
+
+
+def test_upload_is_admitted_once_and_settled_on_usage(client, headers, monkeypatch):
+    fake = MindmapBackend()
+    monkeypatch.setattr(ai_utils, "backend", fake)
+
+    files = {"file": ("within.pdf", upload_pdf(400), "application/pdf")}
+    r = client.post("/ai/mindmap/upload", files=files, headers=headers)
+
+    assert r.status_code == 200
+    assert r.json()["mindmap"]["children"]
+    assert fake.calls >= 2
+
+
+def test_upload_over_budget_runs_as_a_job(client, headers, monkeypatch):
+    import time
+    from fastapi.security import HTTPAuthorizationCredentials
+    from main import get_current_user
+    from ratelimit import user_limiter
+
+    fake = MindmapBackend()
+    monkeypatch.setattr(ai_utils, "backend", fake)
+
+    # Spend this account's whole budget first
+    token = headers["Authorization"].split()[1]
+    user = get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    user_limiter.store.give(f"user:{user.id}", -user_limiter.store.capacity)
+
+    files = {"file": ("over.pdf", upload_pdf(300), "application/pdf")}
+    r = client.post("/ai/mindmap/upload", files=files, headers=headers)
+    assert r.status_code == 202
+    assert fake.calls == 0
+
+    for _ in range(200):
+        job = client.get(r.json()["poll"], headers=headers).json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+    assert job["result"]["mindmap"]["children"]
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+
+import ai_utils
+from ai_backends import LLMBackend
+from ai_resilience import upstream_policy
+
+
+class TimingOutBackend(LLMBackend):
+    async def astream(self, prompt, model, max_tokens, temperature):
+        raise asyncio.TimeoutError()
+
+
+@pytest.fixture
+def breaker():
+    yield upstream_policy.breaker
+    upstream_policy.breaker.record_success()
+
+
+def open_breaker(breaker):
+    breaker.state = "open"
+    breaker.opened_at = time.monotonic()
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/ai/notes/stream", {"topic": "Breaker open notes"}),
+    ("/ai/plan/stream", {"topic": "Breaker open plan"}),
+    ("/ai/quiz/stream", {"topic": "Breaker open quiz"}),
+    ("/ai/tutor/stream", {"message": "Breaker open tutor"}),
+])
+def test_open_breaker_is_a_503_before_the_stream_starts(client, headers, breaker, path, body):
+    open_breaker(breaker)
+
+    r = client.post(path, json=body, headers=headers)
+
+    assert r.status_code == 503
+    assert int(r.headers["Retry-After"]) >= 1
+    assert r.headers["content-type"].startswith("application/json")
+
+
+def test_upstream_timeout_is_a_504(client, headers, breaker, monkeypatch):
+    monkeypatch.setattr(ai_utils, "backend", TimingOutBackend())
+    monkeypatch.setattr(upstream_policy, "base", 0.0)
+
+    r = client.post("/ai/notes/stream", json={"topic": "Timing out notes"}, headers=headers)
+
+    assert r.status_code == 504
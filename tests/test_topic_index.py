@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from topic_index import TopicIndex, canonicalize
+
+
+def resolve_after(first, second):
+    index = TopicIndex(0.8, 1000)
+    index.resolve(first)
+    return index.resolve(second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("DNA", "RNA"),
+    ("Lava", "Java"),
+    ("ionic bonds", "tonic bonds"),
+    ("alkanes", "alkenes"),
+    ("alkenes", "alkynes"),
+    ("alkanes", "alkynes"),
+    ("Ionic", "Iconic"),
+    ("absorption", "adsorption"),
+    ("World War 1", "World War 2"),
+    ("Photosynthesis", "Photosynthesis in plants"),
+    ("C++", "C"),
+    ("C#", "C"),
+    ("C++", "C#"),
+    ("F#", "F"),
+    ("A* search", "search"),
+    ("Vitamin A", "Vitamin"),
+    ("Hepatitis A", "Hepatitis"),
+    (".NET", "NET"),
+    ("Dog bites man", "Man bites dog"),
+    ("cellular respiration", "respiration cellular"),
+])
+def test_different_topics_stay_distinct(first, second):
+    assert resolve_after(first, second) == second
+    assert resolve_after(second, first) == first
+
+
+@pytest.mark.parametrize("variant", [
+    "photosynthesis",
+    "  PHOTOSYNTHESIS ",
+    "Photosynthesis?!",
+    "The Photosynthesis",
+    "photosynthesis, the",
+])
+def test_canonical_variants_share_a_topic(variant):
+    assert resolve_after("Photosynthesis", variant) == "Photosynthesis"
+
+
+def test_dropped_letter_in_a_long_word_shares_a_topic():
+    assert resolve_after("Photosynthesis", "Photosyntesis") == "Photosynthesis"
+
+
+@pytest.mark.parametrize("topic, canon", [
+    ("C++", "c plus plus"),
+    ("c ++", "c plus plus"),
+    ("C#", "c sharp"),
+    ("A* search", "a star search"),
+    ("Vitamin A", "vitamin a"),
+    (".NET", "dot net"),
+    ("The Causes of WW1", "causes ww1"),
+    ("The", "the"),
+])
+def test_canonical_form(topic, canon):
+    assert canonicalize(topic) == canon
+
+
+def test_resolve_async_matches_resolve():
+    index = TopicIndex(0.8, 1000)
+    index.resolve("Photosynthesis")
+    assert asyncio.run(index.resolve_async("photosynthesis!")) == "Photosynthesis"
@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models  # noqa: F401  (registers the tables)
+from db import Base
+from models import TutorSession, TutorTurn
+from tutor import TUTOR_SESSION_TTL_DAYS, TutorSessions
+
+
+def make_sessions():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return TutorSessions(sessionmaker(bind=engine))
+
+
+def count(sessions, table):
+    with sessions.session_factory() as session:
+        return session.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_without_session_nothing_is_stored():
+    sessions = make_sessions()
+
+    async def chat():
+        for _ in range(3):
+            ctx = await sessions.open(1, None, "what is osmosis?")
+            assert ctx.session_id is None
+            assert await sessions.record(ctx, "what is osmosis?", "water moving") is False
+
+    asyncio.run(chat())
+    assert count(sessions, TutorSession) == 0
+    assert count(sessions, TutorTurn) == 0
+
+
+def test_session_is_created_on_request_and_continued():
+    sessions = make_sessions()
+
+    async def chat():
+        ctx = await sessions.open(1, None, "hi", create=True)
+        await sessions.record(ctx, "hi", "hello")
+        again = await sessions.open(1, ctx.session_id, "and then?")
+        return ctx.session_id, again
+
+    session_id, again = asyncio.run(chat())
+    assert again.session_id == session_id
+    assert again.turns == [("user", "hi"), ("tutor", "hello")]
+    assert count(sessions, TutorSession) == 1
+
+
+def test_sweep_removes_only_idle_sessions():
+    sessions = make_sessions()
+
+    async def start(n):
+        ids = []
+        for _ in range(n):
+            ctx = await sessions.open(1, None, "hi", create=True)
+            await sessions.record(ctx, "hi", "hello")
+            ids.append(ctx.session_id)
+        return ids
+
+    idle, fresh = asyncio.run(start(3)), asyncio.run(start(1))
+    with sessions.session_factory() as session:
+        session.execute(
+            update(TutorSession).where(TutorSession.id.in_(idle))
+            .values(updated_at=datetime.utcnow() - timedelta(days=TUTOR_SESSION_TTL_DAYS + 1))
+        )
+        session.commit()
+
+    assert sessions.sweep_idle(batch_size=2) == 3
+    assert count(sessions, TutorSession) == 1
+    assert count(sessions, TutorTurn) == 2
+    assert sessions.transcript(fresh[0], 1)["turn_count"] == 2
@@ -0,0 +1,444 @@
+# backend/topic_index.py
+# Maps free-text topics onto ones already generated, so "Photosynthesis ",
+# "the photosynthesis" and "Photosyntesis" share one cache entry. Topics
+# are folded to a canonical form (exact matches), then compared as TF-IDF
+# vectors of character trigrams with a cosine search over an inverted
+# index held in NumPy arrays (near matches). A near match must also use
+# the same words in the same order, allowing only a slipped letter in a
+# long word: "RNA" is not "DNA" and "alkenes" are not "alkanes".
+#
+#   python topic_index.py --topics 100000      # lookup latency benchmark
+import os
+import re
+import math
+import time
+import random
+import asyncio
+import threading
+import unicodedata
+from array import array
+
+import metrics
+
+TOPIC_INDEX_ENABLED = os.getenv("TOPIC_INDEX_ENABLED", "1") == "1"
+TOPIC_MATCH_THRESHOLD = float(os.getenv("TOPIC_MATCH_THRESHOLD", "0.8"))    # cosine; > 1 disables near matches
+TOPIC_TYPO_MIN_LEN = int(os.getenv("TOPIC_TYPO_MIN_LEN", "6"))             # shorter words must match exactly
+TOPIC_INDEX_MAX = int(os.getenv("TOPIC_INDEX_MAX", "100000"))
+TOPIC_MAX_CHARS = 200
+
+NGRAM = 3
+DIMS = 1 << 18              # trigrams are hashed into this many buckets
+TAIL_MIN = 512              # topics added since the last rebuild are scanned separately
+TAIL_FRACTION = 0.02
+POSTINGS_BUDGET = 30000     # postings read per lookup, rarest trigrams first
+RESCORE = 32                # approximate top-k rescored exactly
+CANDIDATES = 5              # best matches checked against the word rules
+
+topic_lookups = metrics.Counter("topic_index_lookups_total", "Topic resolutions by outcome", ("result",))
+
+_NON_WORD = re.compile(r"[\W_]+")
+_DIGITS = re.compile(r"\d+")
+# Symbols that name things ("C++", "C#", "A*", ".NET") become words before
+# punctuation is stripped, so they can't fold into "C", "A" or "NET"
+_SYMBOLS = re.compile(r"[+#*]|(?<!\w)\.(?=\w)")
+_SYMBOL_WORDS = {"+": " plus ", "#": " sharp ", "*": " star ", ".": " dot "}
+# No single letters: "Vitamin A", "Hepatitis A" and "A*" need theirs
+STOP_WORDS = frozenset(("an", "the", "of", "and", "in", "on", "for", "to"))
+
+
+def canonicalize(topic) -> str:
+    # Case, width, accents-as-composed, punctuation, whitespace and stop
+    # word folding ("The Causes of WW1" == "causes ww1"); a topic made only
+    # of stop words keeps them
+    text = unicodedata.normalize("NFKC", str(topic or ""))[:TOPIC_MAX_CHARS].casefold()
+    text = _SYMBOLS.sub(lambda m: _SYMBOL_WORDS[m.group()], text)
+    words = _NON_WORD.sub(" ", text).split()
+    return " ".join([w for w in words if w not in STOP_WORDS] or words)
+
+
+def display_form(topic) -> str:
+    return " ".join(str(topic or "").split())[:TOPIC_MAX_CHARS]
+
+
+def _grams(canon: str):
+    # {hashed trigram: count}, padded so word starts and ends count
+    padded = f" {canon} "
+    counts = {}
+    for i in range(len(padded) - NGRAM + 1):
+        g = hash(padded[i:i + NGRAM]) & (DIMS - 1)
+        counts[g] = counts.get(g, 0) + 1
+    return counts
+
+
+def _slip(a: str, b: str) -> bool:
+    # One letter dropped, added or swapped with its neighbour. Substitutions
+    # are left out: they are how real terms differ (alkane/alkene,
+    # absorption/adsorption), and so are short words (DNA/RNA, ionic/tonic)
+    if min(len(a), len(b)) < TOPIC_TYPO_MIN_LEN:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    if abs(len(a) - len(b)) != 1:
+        return False
+    short, long = sorted((a, b), key=len)
+    i = 0
+    while i < len(short) and short[i] == long[i]:
+        i += 1
+    return short[i:] == long[i + 1:]
+
+
+def _same_words(a: str, b: str) -> bool:
+    # Word for word in the same order ("dog bites man" is not "man bites
+    # dog"); a word that differs must be a slip of the one in its place
+    wa, wb = a.split(), b.split()
+    return len(wa) == len(wb) and all(x == y or _slip(x, y) for x, y in zip(wa, wb))
+
+
+class TopicIndex:
+    # Document ids are positions in the flat arrays below; everything before
+    # `_built` is in the inverted index, the rest (the tail) is scored by a
+    # vectorized scan until a background rebuild folds it in.
+    def __init__(self, threshold: float, max_topics: int, enabled: bool = True):
+        self.threshold = threshold
+        self.max_topics = max_topics
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._reset()
+        self.exact = 0
+        self.near = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+
+    def _reset(self):
+        self._display = []           # doc id -> topic text used for prompts
+        self._canon = []             # doc id -> canonical form
+        self._by_canon = {}          # canonical form -> doc id
+        self._offsets = array("q", [0])
+        self._gram_ids = array("i")
+        self._tf = array("f")
+        self._built = 0
+        self._idf = None
+        self._indptr = None
+        self._post_docs = None
+        self._post_w = None
+        self._doc_offsets = None
+        self._doc_grams = None
+        self._doc_w = None
+        self._qbuf = None
+        self._tail = None
+        self._rebuilding = False
+
+    def __len__(self):
+        return len(self._display)
+
+    # ============================================================
+    # RESOLVE (lookup, then remember the topic if it is new)
+    # ============================================================
+    def resolve(self, topic) -> str:
+        display = display_form(topic)
+        canon = canonicalize(display)
+        if not self.enabled or not canon:
+            return display
+
+        with self._lock:
+            doc = self._by_canon.get(canon)
+            if doc is not None:
+                self.exact += 1
+                topic_lookups.labels("exact").inc()
+                return self._display[doc]
+
+            match = self._nearest(canon) if self.threshold <= 1 else None
+            if match is not None:
+                self.near += 1
+                topic_lookups.labels("near").inc()
+                return self._display[match]
+
+            self.misses += 1
+            topic_lookups.labels("miss").inc()
+            self._add(display, canon)
+            rebuild = self._needs_rebuild()
+
+        if rebuild:
+            threading.Thread(target=self.rebuild, name="topic-index-rebuild", daemon=True).start()
+        return display
+
+    # The near search is ~1-2 ms of NumPy at 100k topics, and the lock may be
+    # held by another lookup; async callers wait for both off the event loop
+    async def resolve_async(self, topic) -> str:
+        if not self.enabled:
+            return display_form(topic)
+        return await asyncio.to_thread(self.resolve, topic)
+
+    def _add(self, display, canon):
+        self._by_canon[canon] = len(self._display)
+        self._display.append(display)
+        self._canon.append(canon)
+        for g, count in _grams(canon).items():
+            self._gram_ids.append(g)
+            self._tf.append(1.0 + math.log(count))
+        self._offsets.append(len(self._gram_ids))
+
+    def _needs_rebuild(self):
+        tail = len(self._display) - self._built
+        if self._rebuilding or tail < max(TAIL_MIN, TAIL_FRACTION * self._built):
+            return False
+        self._rebuilding = True
+        return True
+
+    # ============================================================
+    # SEARCH
+    # Candidates come from the postings of the query's rarest trigrams
+    # (bounded work however common the rest are), then the best few are
+    # rescored exactly. `_qbuf` is a dense query vector reused under the lock.
+    # ============================================================
+    def _query(self, canon, np):
+        grams = _grams(canon)
+        ids = np.fromiter(grams.keys(), dtype=np.int64, count=len(grams))
+        w = np.fromiter((1.0 + math.log(c) for c in grams.values()), dtype=np.float32, count=len(grams))
+        if self._idf is not None:
+            w *= self._idf[ids]
+        return ids, w / np.linalg.norm(w)
+
+    def _nearest(self, canon):
+        import numpy as np
+
+        if not self._display:
+            return None
+        if self._qbuf is None:
+            self._qbuf = np.zeros(DIMS, dtype=np.float32)
+        ids, qw = self._query(canon, np)
+        q = self._qbuf
+        q[ids] = qw
+        try:
+            docs, scores = self._search_built(ids, q, np)
+            if len(self._display) > self._built:
+                tail_docs, tail_scores = self._scan_tail(q, np)
+                docs = np.concatenate([docs, tail_docs])
+                scores = np.concatenate([scores, tail_scores])
+        finally:
+            q[ids] = 0
+
+        for i in np.argsort(scores)[::-1][:CANDIDATES]:
+            score, doc = scores[i], int(docs[i])
+            if score < self.threshold:
+                break
+            other = self._canon[doc]
+            # Trigrams barely see "ww1" vs "ww2"; numbers must agree exactly
+            if _DIGITS.findall(other) != _DIGITS.findall(canon):
+                continue
+            # Cosine alone scores "ionic bonds" close to "tonic bonds"
+            if _same_words(canon, other):
+                return doc
+        return None
+
+    def _search_built(self, ids, q, np):
+        if not self._built:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        starts, ends = self._indptr[ids], self._indptr[ids + 1]
+        order = np.argsort(ends - starts)
+        keep = order[np.cumsum((ends - starts)[order]) <= POSTINGS_BUDGET]
+        if len(keep) == 0:
+            keep = order[:1]
+        docs = np.concatenate([self._post_docs[starts[i]:ends[i]] for i in keep])
+        vals = np.concatenate([self._post_w[starts[i]:ends[i]] * q[ids[i]] for i in keep])
+        if len(docs) == 0:
+            return docs.astype(np.int64), vals
+
+        approx = np.bincount(docs, weights=vals)
+        hit = np.flatnonzero(approx)   # argpartition degrades on long runs of zeros
+        top = hit[np.argpartition(approx[hit], -RESCORE)[-RESCORE:]] if len(hit) > RESCORE else hit
+
+        # Exact cosine over each candidate's full (doc-ordered) vector
+        lo, hi = self._doc_offsets[top], self._doc_offsets[top + 1]
+        lengths = hi - lo
+        idx = np.repeat(lo - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        contrib = self._doc_w[idx] * q[self._doc_grams[idx]]
+        return top, np.add.reduceat(contrib, np.cumsum(lengths) - lengths) if len(top) else contrib[:0]
+
+    def _scan_tail(self, q, np):
+        n = len(self._display)
+        if self._tail is None or self._tail[0] != (self._built, n):
+            # Normalized tail vectors, kept until the next add or rebuild
+            start = self._offsets[self._built]
+            grams = np.array(self._gram_ids[start:], dtype=np.int64)
+            tf = np.array(self._tf[start:], dtype=np.float32)
+            lengths = np.diff(np.array(self._offsets[self._built:], dtype=np.int64))
+            docs = np.repeat(np.arange(len(lengths)), lengths)
+            w = tf * self._idf[grams] if self._idf is not None else tf
+            w /= np.sqrt(np.bincount(docs, weights=w * w, minlength=len(lengths))).astype(np.float32)[docs]
+            self._tail = ((self._built, n), grams, docs, w)
+
+        _, grams, docs, w = self._tail
+        dots = np.bincount(docs, weights=w * q[grams], minlength=n - self._built)
+        return np.arange(self._built, n), dots.astype(np.float32)
+
+    # ============================================================
+    # REBUILD (off the request path; lookups keep using the old arrays)
+    # ============================================================
+    def rebuild(self):
+        import numpy as np
+
+        started = time.perf_counter()
+        try:
+            with self._lock:
+                n = len(self._display)
+                drop = max(0, n - self.max_topics)
+                if drop:
+                    self._evict(drop)
+                    n -= drop
+                end = self._offsets[n]
+                grams = np.array(self._gram_ids[:end], dtype=np.int64)
+                tf = np.array(self._tf[:end], dtype=np.float32)
+                offsets = np.array(self._offsets[:n + 1], dtype=np.int64)
+
+            docs = np.repeat(np.arange(n, dtype=np.int32), np.diff(offsets))
+            df = np.bincount(grams, minlength=DIMS)
+            idf = (np.log((n + 1) / (df + 1)) + 1).astype(np.float32)
+            w = tf * idf[grams]
+            w /= np.sqrt(np.bincount(docs, weights=w * w, minlength=n)).astype(np.float32)[docs]
+            order = np.argsort(grams, kind="stable")
+            indptr = np.zeros(DIMS + 1, dtype=np.int64)
+            np.cumsum(df, out=indptr[1:])
+
+            with self._lock:
+                self._idf = idf
+                self._indptr = indptr
+                self._post_docs = docs[order]
+                self._post_w = w[order]
+                self._doc_offsets = offsets
+                self._doc_grams = grams
+                self._doc_w = w
+                self._built = n
+        finally:
+            with self._lock:
+                self._rebuilding = False
+        self.rebuilds += 1
+        self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+
+    def _evict(self, count):
+        # Oldest topics go first; doc ids shift down, so the built arrays
+        # are dropped too (the rebuild in progress replaces them)
+        cut = self._offsets[count]
+        del self._display[:count]
+        del self._canon[:count]
+        del self._gram_ids[:cut]
+        del self._tf[:cut]
+        self._offsets = array("q", (o - cut for o in self._offsets[count:]))
+        self._by_canon = {canon: i for i, canon in enumerate(self._canon)}
+        self._built = 0
+        self._idf = self._indptr = self._post_docs = self._post_w = None
+        self._doc_offsets = self._doc_grams = self._doc_w = None
+        self._tail = None
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "topics": len(self._display),
+            "indexed": self._built,
+            "exact": self.exact,
+            "near": self.near,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": round(self.last_rebuild_ms, 1),
+        }
+
+
+def warmup():
+    import numpy  # noqa: F401  (~100 ms, loaded by the startup warmup)
+
+
+topic_index = TopicIndex(TOPIC_MATCH_THRESHOLD, TOPIC_INDEX_MAX, enabled=TOPIC_INDEX_ENABLED)
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+def _synthetic_topics(count, seed=1):
+    # Subject-like words built from syllables ("thermokinetics", "cytonomy"),
+    # 1-4 per topic, some with a number
+    rng = random.Random(seed)
+    heads = ("photo", "bio", "geo", "thermo", "electro", "hydro", "micro", "neuro", "astro", "chemo",
+             "cyto", "eco", "crypto", "macro", "proto", "quantum", "nano", "socio", "psycho", "aero",
+             "paleo", "immuno", "litho", "morpho", "patho", "phyto", "radio", "seismo", "tecto", "volcano")
+    mids = ("", "", "syn", "ki", "ma", "lo", "gra", "no", "the", "ta", "ri", "pho", "dy", "me")
+    tails = ("synthesis", "logy", "dynamics", "magnetism", "graphy", "nomics", "metry", "kinetics",
+             "statics", "chemistry", "physics", "genesis", "mechanics", "systems", "theory", "nomy",
+             "sphere", "lysis", "tropism", "plasm")
+    words = ("in plants", "of cells", "for beginners", "basics", "advanced", "exam review", "of europe",
+             "applications", "history", "methods", "and society", "models", "of the ocean", "laws")
+    topics = set()
+    while len(topics) < count:
+        parts = [rng.choice(heads) + rng.choice(mids) + rng.choice(tails) for _ in range(rng.randint(1, 2))]
+        if rng.random() < 0.5:
+            parts.append(rng.choice(words))
+        if rng.random() < 0.3:
+            parts.append(str(rng.randint(1, 500)))
+        topics.add(" ".join(parts))
+    return list(topics)
+
+
+def _typo(text, rng):
+    # A letter dropped from a word long enough to count as a slip
+    starts = [m.start() for m in re.finditer(r"\w{%d,}" % (TOPIC_TYPO_MIN_LEN + 1), text)]
+    if not starts:
+        return text
+    i = rng.choice(starts) + 1 + rng.randrange(TOPIC_TYPO_MIN_LEN - 1)
+    return text[:i] + text[i + 1:]
+
+
+def benchmark(count: int, queries: int):
+    rng = random.Random(7)
+    topics = _synthetic_topics(count)
+    index = TopicIndex(TOPIC_MATCH_THRESHOLD, max(count, TOPIC_INDEX_MAX))
+
+    started = time.perf_counter()
+    for topic in topics:
+        with index._lock:
+            index._add(display_form(topic), canonicalize(topic))
+    add_ms = (time.perf_counter() - started) * 1000
+    index.rebuild()
+    print(f"{count} topics: add {add_ms:.0f} ms, rebuild {index.last_rebuild_ms:.0f} ms")
+
+    def timed(label, items):
+        times, near = [], 0
+        for text in items:
+            canon = canonicalize(text)
+            t = time.perf_counter()
+            with index._lock:
+                doc = index._by_canon.get(canon)
+                if doc is None:
+                    doc = index._nearest(canon)
+                    near += doc is not None
+            times.append((time.perf_counter() - t) * 1e6)
+        times.sort()
+        p50, p99 = times[len(times) // 2], times[int(len(times) * 0.99)]
+        print(f"  {label:<22} p50 {p50:8.1f} us  p99 {p99:8.1f} us  near matches {near}/{len(items)}")
+
+    sample = rng.sample(topics, queries)
+    timed("exact (case/space)", [f"  {t.upper()} " for t in sample])
+    timed("typo (1 char deleted)", [_typo(t, rng) for t in sample])
+    timed("unseen", [f"zz{rng.randint(0, 10**6)} unrelated query" for _ in range(queries)])
+
+    # Tail scan cost just before the next rebuild would fire
+    for topic in _synthetic_topics(int(count * TAIL_FRACTION) + count, seed=2)[count:]:
+        with index._lock:
+            index._add(display_form(topic), canonicalize(topic))
+    timed(f"typo, {len(index) - index._built} in tail", [_typo(t, rng) for t in sample])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Topic index lookup latency")
+    parser.add_argument("--topics", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    benchmark(args.topics, args.queries)
@@ -0,0 +1,328 @@
+# backend/tutor.py
+import os
+import logging
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import delete, func, insert, select, update
+
+import ai_utils
+from ai_utils import CHARS_PER_TOKEN, estimate_tokens
+from db import SessionLocal
+from models import TutorSession, TutorTurn
+
+logger = logging.getLogger(__name__)
+
+TUTOR_WINDOW_TURNS = int(os.getenv("TUTOR_WINDOW_TURNS", "6"))            # recent messages sent verbatim
+TUTOR_PROMPT_TOKENS = int(os.getenv("TUTOR_PROMPT_TOKENS", "2000"))       # hard cap on the prompt
+TUTOR_SUMMARY_TOKENS = int(os.getenv("TUTOR_SUMMARY_TOKENS", "300"))
+TUTOR_COMPACT_BATCH = int(os.getenv("TUTOR_COMPACT_BATCH", "4"))          # turns past the window before summarizing
+TUTOR_COMPACT_INPUT_TOKENS = int(os.getenv("TUTOR_COMPACT_INPUT_TOKENS", "3000"))
+TUTOR_SESSION_TTL_DAYS = int(os.getenv("TUTOR_SESSION_TTL_DAYS", "30"))   # idle sessions are swept after this
+TUTOR_SWEEP_INTERVAL = int(os.getenv("TUTOR_SWEEP_INTERVAL", "3600"))
+TUTOR_SWEEP_BATCH = int(os.getenv("TUTOR_SWEEP_BATCH", "500"))
+TUTOR_TRANSCRIPT_MAX = 200
+
+PROMPT_OVERHEAD_TOKENS = 40    # instructions and speaker labels
+
+
+class TutorContext(NamedTuple):
+    session_id: str    # None for a one-off (unsaved) exchange
+    summary: str
+    turns: list        # [(role, content)] oldest first, already within budget
+    message: str
+    unsummarized: int  # turns not yet folded into the summary
+    dropped: int       # unsummarized turns the budget left out
+
+
+def _tail(text: str, tokens: int) -> str:
+    # Keep the end: a pasted conversation ends with the actual question
+    limit = max(0, tokens) * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[len(text) - limit:]
+
+
+def fit_context(summary: str, turns, message: str, budget: int = TUTOR_PROMPT_TOKENS):
+    # Message gets at most half the budget, the summary its own cap, and
+    # recent turns fill what is left, newest first
+    message = _tail(message, budget // 2)
+    summary = summary[:TUTOR_SUMMARY_TOKENS * CHARS_PER_TOKEN]
+    room = budget - PROMPT_OVERHEAD_TOKENS - estimate_tokens(message) - (estimate_tokens(summary) if summary else 0)
+
+    kept = []
+    for role, content in reversed(turns[-TUTOR_WINDOW_TURNS:]):
+        cost = estimate_tokens(content) + 2
+        if cost > room:
+            break
+        kept.append((role, content))
+        room -= cost
+    kept.reverse()
+    return summary, kept, message, len(turns) - len(kept)
+
+
+# ============================================================
+# TUTOR SESSIONS
+# Each call sends the rolling summary plus the last few turns; once
+# TUTOR_COMPACT_BATCH turns have fallen out of the window (or the budget
+# had to drop an exchange), they are folded into the summary in the background,
+# after the reply has gone out. Sessions are only created when the client
+# asks for one, and are swept once idle for TUTOR_SESSION_TTL_DAYS.
+# ============================================================
+class TutorSessions:
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self._compacting = set()
+        self._tasks = set()
+        self.created = 0
+        self.swept = 0
+        self.turns = 0
+        self.trimmed = 0
+        self.compactions = 0
+        self.compaction_errors = 0
+
+    async def open(self, user_id: int, session_id, message: str, create: bool = False):
+        # -> TutorContext, or None if session_id isn't one of this user's.
+        # Without a session_id the exchange is one-off unless `create` is set.
+        if not session_id and not create:
+            summary, turns = "", []
+        elif not session_id:
+            session_id = uuid.uuid4().hex
+            await asyncio.to_thread(self._create, session_id, user_id)
+            self.created += 1
+            summary, turns = "", []
+        else:
+            state = await asyncio.to_thread(self._load, session_id, user_id)
+            if state is None:
+                return None
+            summary, turns = state
+
+        summary, kept, message, dropped = fit_context(summary, turns, message)
+        if dropped:
+            self.trimmed += 1
+        return TutorContext(session_id, summary, kept, message, len(turns), dropped)
+
+    async def exists(self, session_id: str, user_id: int) -> bool:
+        return await asyncio.to_thread(self._owned, session_id, user_id)
+
+    async def record(self, ctx: TutorContext, message: str, reply: str) -> bool:
+        # Stores the exchange; True when the session is due for compaction.
+        # A single dropped turn waits for the next exchange, so long turns
+        # don't cost a summary call on every message.
+        if ctx.session_id is None:
+            return False
+        await asyncio.to_thread(self._append, ctx.session_id, message, reply)
+        self.turns += 2
+        return ctx.dropped >= 2 or ctx.unsummarized + 2 >= TUTOR_WINDOW_TURNS + TUTOR_COMPACT_BATCH
+
+    # For callers without a response to hang BackgroundTasks on (jobs)
+    def compact_soon(self, session_id: str):
+        task = asyncio.create_task(self.compact(session_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def compact(self, session_id: str):
+        if session_id in self._compacting:
+            return
+        self._compacting.add(session_id)
+        try:
+            while True:
+                state = await asyncio.to_thread(self._unsummarized, session_id)
+                if state is None:
+                    return
+                summary, through, turns = state
+                fold = self._to_fold(turns)
+                if not fold:
+                    return
+                summary = await ai_utils.summarize_tutor_async(
+                    summary, [(t.role, t.content) for t in fold], TUTOR_SUMMARY_TOKENS
+                )
+                if not await asyncio.to_thread(self._save_summary, session_id, through, fold[-1].id, summary):
+                    return   # another worker folded these turns first
+                self.compactions += 1
+        except Exception:
+            self.compaction_errors += 1
+            logger.exception("Tutor compaction failed")
+        finally:
+            self._compacting.discard(session_id)
+
+    def _to_fold(self, turns):
+        # Keep the newest turns that a typical prompt can carry verbatim and
+        # fold the older ones, at most TUTOR_COMPACT_INPUT_TOKENS per call
+        room = TUTOR_PROMPT_TOKENS - PROMPT_OVERHEAD_TOKENS - TUTOR_SUMMARY_TOKENS - TUTOR_PROMPT_TOKENS // 4
+        keep = 0
+        for t in reversed(turns[-TUTOR_WINDOW_TURNS:]):
+            room -= estimate_tokens(t.content) + 2
+            if room < 0:
+                break
+            keep += 1
+
+        fold, used = [], 0
+        for t in turns[:len(turns) - keep]:
+            used += estimate_tokens(t.content)
+            if fold and used > TUTOR_COMPACT_INPUT_TOKENS:
+                break
+            fold.append(t)
+        return fold
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def sweeper(self, interval: int = TUTOR_SWEEP_INTERVAL):
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.sweep_idle)
+                if removed:
+                    logger.info("Swept %d idle tutor sessions", removed)
+            except Exception:
+                logger.exception("Tutor session sweep failed")
+            await asyncio.sleep(interval)
+
+    # ---------- DB (called via asyncio.to_thread) ----------
+    def _create(self, session_id, user_id):
+        now = datetime.utcnow()
+        with self.session_factory() as session:
+            session.execute(insert(TutorSession), [{
+                "id": session_id, "user_id": user_id, "summary": "", "summarized_through": 0,
+                "created_at": now, "updated_at": now,
+            }])
+            session.commit()
+
+    def _owned(self, session_id, user_id):
+        with self.session_factory() as session:
+            row = session.execute(select(TutorSession.user_id).where(TutorSession.id == session_id)).first()
+        return row is not None and row.user_id == user_id
+
+    def _load(self, session_id, user_id):
+        with self.session_factory() as session:
+            row = session.execute(
+                select(TutorSession.user_id, TutorSession.summary, TutorSession.summarized_through)
+                .where(TutorSession.id == session_id)
+            ).first()
+            if row is None or row.user_id != user_id:
+                return None
+            # One past the compaction trigger is enough to know it is due
+            recent = session.execute(
+                select(TutorTurn.role, TutorTurn.content)
+                .where(TutorTurn.session_id == session_id, TutorTurn.id > row.summarized_through)
+                .order_by(TutorTurn.id.desc())
+                .limit(TUTOR_WINDOW_TURNS + TUTOR_COMPACT_BATCH)
+            ).all()
+        return row.summary, [(r.role, r.content) for r in reversed(recent)]
+
+    def _append(self, session_id, message, reply):
+        # Anything past the prompt budget can never be sent again, so it isn't kept
+        limit = TUTOR_PROMPT_TOKENS * CHARS_PER_TOKEN
+        now = datetime.utcnow()
+        with self.session_factory() as session:
+            session.execute(insert(TutorTurn), [
+                {"session_id": session_id, "role": "user", "content": _tail(message, TUTOR_PROMPT_TOKENS), "created_at": now},
+                {"session_id": session_id, "role": "tutor", "content": reply[:limit], "created_at": now},
+            ])
+            session.execute(
+                update(TutorSession).where(TutorSession.id == session_id).values(updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+    def _unsummarized(self, session_id):
+        with self.session_factory() as session:
+            row = session.execute(
+                select(TutorSession.summary, TutorSession.summarized_through).where(TutorSession.id == session_id)
+            ).first()
+            if row is None:
+                return None
+            turns = session.execute(
+                select(TutorTurn.id, TutorTurn.role, TutorTurn.content)
+                .where(TutorTurn.session_id == session_id, TutorTurn.id > row.summarized_through)
+                .order_by(TutorTurn.id)
+                .limit(TUTOR_TRANSCRIPT_MAX)
+            ).all()
+        return row.summary, row.summarized_through, turns
+
+    # Conditional on the summary being unchanged since it was read
+    def _save_summary(self, session_id, expected_through, through, summary):
+        with self.session_factory() as session:
+            saved = session.execute(
+                update(TutorSession)
+                .where(TutorSession.id == session_id, TutorSession.summarized_through == expected_through)
+                .values(summary=summary, summarized_through=through)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            session.commit()
+        return bool(saved)
+
+    def transcript(self, session_id, user_id):
+        with self.session_factory() as session:
+            row = session.get(TutorSession, session_id)
+            if row is None or row.user_id != user_id:
+                return None
+            turns = session.execute(
+                select(TutorTurn.role, TutorTurn.content, TutorTurn.created_at)
+                .where(TutorTurn.session_id == session_id)
+                .order_by(TutorTurn.id.desc())
+                .limit(TUTOR_TRANSCRIPT_MAX)
+            ).all()
+            count = session.execute(
+                select(func.count()).select_from(TutorTurn).where(TutorTurn.session_id == session_id)
+            ).scalar()
+            return {
+                "session_id": row.id,
+                "summary": row.summary,
+                "turn_count": count,
+                "turns": [{"role": t.role, "content": t.content, "created_at": t.created_at} for t in reversed(turns)],
+                "created_at": row.created_at,
+                "updated_at": row.updated_at,
+            }
+
+    def delete(self, session_id, user_id) -> bool:
+        if not self._owned(session_id, user_id):
+            return False
+        with self.session_factory() as session:
+            session.execute(delete(TutorTurn).where(TutorTurn.session_id == session_id))
+            session.execute(delete(TutorSession).where(TutorSession.id == session_id))
+            session.commit()
+        return True
+
+    def sweep_idle(self, batch_size: int = TUTOR_SWEEP_BATCH) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=TUTOR_SESSION_TTL_DAYS)
+        total = 0
+        with self.session_factory() as session:
+            while True:
+                ids = session.execute(
+                    select(TutorSession.id).where(TutorSession.updated_at < cutoff).limit(batch_size)
+                ).scalars().all()
+                if ids:
+                    # Re-checked on delete: a turn may have landed since the select
+                    total += session.execute(
+                        delete(TutorSession).where(TutorSession.id.in_(ids), TutorSession.updated_at < cutoff)
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+                    live = select(TutorSession.id).where(TutorSession.id.in_(ids))
+                    session.execute(
+                        delete(TutorTurn).where(TutorTurn.session_id.in_(ids), TutorTurn.session_id.not_in(live))
+                        .execution_options(synchronize_session=False)
+                    )
+                    session.commit()
+                if len(ids) < batch_size:
+                    self.swept += total
+                    return total
+
+    def stats(self):
+        return {
+            "window_turns": TUTOR_WINDOW_TURNS,
+            "prompt_tokens": TUTOR_PROMPT_TOKENS,
+            "sessions_created": self.created,
+            "sessions_swept": self.swept,
+            "session_ttl_days": TUTOR_SESSION_TTL_DAYS,
+            "turns": self.turns,
+            "trimmed_prompts": self.trimmed,
+            "compactions": self.compactions,
+            "compaction_errors": self.compaction_errors,
+            "compacting": len(self._compacting),
+        }
+
+
+tutor_sessions = TutorSessions(SessionLocal)